@@ -0,0 +1,221 @@
+# in-process response cache for the Spoonacular API helpers
+
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from functools import wraps
+from inspect import signature
+
+import requests
+from flask import current_app, has_app_context
+from single_flight import single_flight
+from upstream_guard import mark_degraded
+
+# never let credentials end up in a cache key
+SECRET_PARAMS = {"apikey", "api_key", "key"}
+
+
+def normalize_value(value):
+    """Normalize a single argument so equivalent calls share a key."""
+    if isinstance(value, str):
+        return " ".join(value.lower().split())
+    return value
+
+
+def make_key(endpoint, params):
+    """Build a hashable cache key from an endpoint name and its params.
+
+    Params are sorted and normalized, and anything that looks like an API
+    key is dropped, so two users asking the same question share an entry.
+    """
+    items = tuple(sorted(
+        (name, normalize_value(value))
+        for name, value in params.items()
+        if name.lower() not in SECRET_PARAMS
+    ))
+    return (endpoint, items)
+
+
+def is_error_response(value):
+    """Spoonacular reports failures as {"status": "failure", ...}."""
+    return isinstance(value, dict) and value.get("status") == "failure"
+
+
+class CacheEntry:
+    __slots__ = ("value", "stored_at", "ttl", "stale_ttl")
+
+    def __init__(self, value, ttl, stale_ttl):
+        self.value = value
+        self.stored_at = time.monotonic()
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+
+    @property
+    def age(self):
+        return time.monotonic() - self.stored_at
+
+    @property
+    def is_fresh(self):
+        return self.age < self.ttl
+
+    @property
+    def is_usable(self):
+        return self.age < self.ttl + self.stale_ttl
+
+
+class ResponseCache:
+    """Size bounded LRU cache of API responses with per entry TTLs.
+
+    Entries past their TTL but still inside their stale window are served
+    as-is while a background thread fetches a replacement
+    (stale-while-revalidate). Hits, misses, stale hits and evictions are
+    counted per endpoint.
+    """
+
+    def __init__(self, maxsize=2048):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._stats = defaultdict(lambda: defaultdict(int))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, allow_expired=False):
+        """Return the usable entry stored under key, or None.
+
+        With allow_expired, entries past their stale window are returned
+        too; they're kept (until LRU eviction) for when the API is down."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not (allow_expired or entry.is_usable):
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, ttl, stale_ttl=0):
+        with self._lock:
+            self._entries[key] = CacheEntry(value, ttl, stale_ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                evicted, _ = self._entries.popitem(last=False)
+                self._stats[evicted[0]]["evictions"] += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._stats.clear()
+
+    def count(self, endpoint, stat):
+        with self._lock:
+            self._stats[endpoint][stat] += 1
+
+    def stats(self):
+        """Return {endpoint: {"hits": n, "misses": n, ...}}."""
+        with self._lock:
+            return {endpoint: dict(counts) for endpoint, counts in self._stats.items()}
+
+    def refresh_in_background(self, key, fetch, ttl, stale_ttl):
+        """Run fetch in a thread and store its result, once per key."""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        app = current_app._get_current_object() if has_app_context() else None
+
+        def refresh():
+            try:
+                if app is not None:
+                    with app.app_context():
+                        value = fetch()
+                else:
+                    value = fetch()
+                if not is_error_response(value):
+                    self.set(key, value, ttl, stale_ttl)
+            except Exception:
+                # keep serving the stale copy, the next caller will retry
+                pass
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+
+api_cache = ResponseCache()
+
+
+def cached(endpoint, ttl, stale_ttl=0, cache=api_cache, flight=single_flight):
+    """Cache the return value of an API helper.
+
+    - endpoint: name used for the key and the hit/miss counters
+    - ttl: seconds a response is served without asking the API again
+    - stale_ttl: extra seconds a response may be served while it is
+      refreshed in the background
+
+    The key is built from the helper's bound arguments, so it never holds
+    the API key or the full request url. Error responses are not cached;
+    when the API fails or is unavailable, an expired copy is served if we
+    still have one (and the request is marked degraded).
+    Concurrent misses for the same key share a single call to the API
+    (see single_flight).
+    """
+
+    def decorator(func):
+        sig = signature(func)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = make_key(endpoint, _bound_arguments(sig, args, kwargs))
+
+            def fetch():
+                # an error response stays with this worker, others ask for themselves
+                return flight.do(key, lambda: func(*args, **kwargs),
+                                 share=lambda value: not is_error_response(value))
+
+            entry = cache.get(key)
+            if entry is not None:
+                if entry.is_fresh:
+                    cache.count(endpoint, "hits")
+                else:
+                    cache.count(endpoint, "stale_hits")
+                    cache.refresh_in_background(key, fetch, ttl, stale_ttl)
+                return entry.value
+
+            cache.count(endpoint, "misses")
+            error = None
+            try:
+                value = fetch()
+            except requests.RequestException as e:
+                value, error = None, e
+            if error is None and not is_error_response(value):
+                cache.set(key, value, ttl, stale_ttl)
+                return value
+
+            # the API failed or refused the call, an old answer beats none
+            expired = cache.get(key, allow_expired=True)
+            if expired is None:
+                if error is not None:
+                    raise error
+                return value
+            cache.count(endpoint, "degraded_hits")
+            mark_degraded()
+            return expired.value
+
+        wrapper.cache_key = lambda *args, **kwargs: make_key(
+            endpoint, _bound_arguments(sig, args, kwargs))
+        return wrapper
+
+    return decorator
+
+
+def _bound_arguments(sig, args, kwargs):
+    bound = sig.bind(*args, **kwargs)
+    bound.apply_defaults()
+    return bound.arguments
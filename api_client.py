@@ -0,0 +1,158 @@
+# shared http client for calls to the Spoonacular API
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from upstream_guard import call_marking_degraded, mark_degraded
+
+
+class UpstreamClient:
+    """One pooled, retrying http client shared by every API helper.
+
+    - connections are kept alive and reused through a requests.Session
+    - every call gets a (connect, read) timeout
+    - idempotent GETs are retried with exponential backoff on connection
+      errors and 5xx responses; read timeouts are not, a stalled API
+      would otherwise hold the request for several timeouts in a row
+    - gather() runs independent calls at the same time on a bounded pool
+    - with a guard (see upstream_guard), calls are refused up front while
+      the rate limit, daily quota or circuit breaker says so, raising
+      UpstreamUnavailable instead of waiting on a struggling API
+    - on_wait is called before each request goes out (and once before
+      gather), to let go of anything the wait shouldn't hold on to, such
+      as the request's database connection
+
+    The session and pool are created lazily and recreated after a fork,
+    so a client built before gunicorn forks its workers is never shared
+    between processes.
+    """
+
+    def __init__(self, base_url, api_key=None, timeout=(3.05, 10), retries=2,
+                 backoff=0.3, pool_size=20, max_workers=8, on_response=None, guard=None,
+                 on_wait=None):
+        self.base_url = base_url.rstrip("/") + "/"
+        self.api_key = api_key
+        # called as on_response(path, status, seconds) after every request,
+        # status is "error" when no response came back at all
+        self.on_response = on_response
+        self.guard = guard
+        self.on_wait = on_wait
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._pid = None
+        self._session = None
+        self._executor = None
+
+    def init_app(self, app):
+        """Configure from API_BASE_URL, API_KEY and API_POOL_SIZE."""
+        self.base_url = (app.config.get("API_BASE_URL") or self.base_url).rstrip("/") + "/"
+        self.api_key = app.config.get("API_KEY", self.api_key)
+        self.pool_size = int(app.config.get("API_POOL_SIZE") or self.pool_size)
+        with self._lock:
+            # rebuild the session with the new pool size on next use
+            self._pid = None
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            retry = Retry(
+                total=self.retries,
+                read=0,
+                backoff_factor=self.backoff,
+                status_forcelist=(500, 502, 503, 504),
+                allowed_methods=frozenset(["GET"]),
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry
+            )
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self._session = session
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="upstream"
+            )
+            self._pid = os.getpid()
+
+    @property
+    def session(self):
+        self._ensure_started()
+        return self._session
+
+    def get(self, path, params=None, timeout=None):
+        """Send a GET for path (relative to base_url) and return the response.
+
+        The API key is added to the query string here so callers never
+        build urls holding it.
+        """
+        params = dict(params or {})
+        if self.api_key:
+            params["apiKey"] = self.api_key
+        # before the guard, which may hand this call the breaker's one
+        # trial; only the finally below gives that back
+        if self.on_wait is not None:
+            self.on_wait()
+        if self.guard is not None:
+            self.guard.before_call()
+        start = time.perf_counter()
+        response = None
+        try:
+            response = self.session.get(
+                urljoin(self.base_url, path.lstrip("/")),
+                params=params,
+                timeout=timeout or self.timeout,
+            )
+            return response
+        finally:
+            if self.guard is not None:
+                self.guard.after_call(response)
+            if self.on_response is not None:
+                status = response.status_code if response is not None else "error"
+                self.on_response(path, status, time.perf_counter() - start)
+
+    def get_json(self, path, params=None, timeout=None):
+        """Send a GET for path and return the decoded JSON body.
+
+        A body that isn't JSON (say a proxy's html error page) comes back
+        as a Spoonacular style {"status": "failure", ...} dict."""
+        response = self.get(path, params=params, timeout=timeout)
+        try:
+            return response.json()
+        except ValueError:
+            return {"status": "failure", "code": response.status_code,
+                    "message": "The API sent a response that isn't JSON."}
+
+    def gather(self, *calls):
+        """Run each zero argument callable concurrently, return their results.
+
+        Results come back in the order the calls were given. If a call
+        raises, its exception is re-raised here. The calls run without the
+        caller's request; if one was answered from fallback data (see
+        mark_degraded), the caller's request is marked degraded here.
+        """
+        self._ensure_started()
+        if self.on_wait is not None:
+            self.on_wait()
+        futures = [self._executor.submit(call_marking_degraded, call) for call in calls]
+        results = []
+        for future in futures:
+            result, degraded = future.result()
+            if degraded:
+                mark_degraded()
+            results.append(result)
+        return results
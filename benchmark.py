@@ -0,0 +1,339 @@
+"""Load test the app against a local fake Spoonacular and report latency per route.
+
+Starts fake_spoonacular.py and the app (threaded werkzeug server) in this
+process, signs up a set of virtual users with fridges, then replays
+traffic across the homepage, recipe search, recipe check-out, ingredient
+search and fridge endpoints. Prints throughput and p50/p95/p99 per route.
+
+    python benchmark.py --users 20 --concurrency 20 --duration 30 --latency 0.15
+    python benchmark.py --trace generator/traces.jsonl --json bench.json
+    python benchmark.py --baseline bench.json   # exit 1 if a route's p95 regressed
+    python benchmark.py --database $DATABASE_URL --seeded --users 100 \\
+        --trace generator/synthetic/traces.jsonl  # users from generator/generate.py
+
+Traces are JSON lines of {"user": n, "method": "GET", "path": "/", "json": null},
+where user is an index into the virtual users; without one a weighted
+mix of realistic requests is generated from generator/ingredients.csv.
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from csv import DictReader
+
+import requests
+
+import fake_spoonacular
+from generator.generate import PASSWORD, username
+
+# (weight, request kind) of the synthetic traffic mix
+MIX = [
+    (30, "homepage"),
+    (20, "ingredient_search"),
+    (10, "fridge_add"),
+    (5, "fridge_remove"),
+    (15, "recipe_search"),
+    (20, "recipe_check_out"),
+]
+
+# collapse ids and queries so requests group by route
+ROUTE_PATTERNS = [
+    (re.compile(r"^/recipe/check-out/\d+"), "/recipe/check-out/<id>"),
+    (re.compile(r"^/ingredient/search/[^?]*"), "/ingredient/search/<query>&<number>"),
+    (re.compile(r"^/fridge/ingredient/search/\d+"), "/fridge/ingredient/search/<ing_id>"),
+    (re.compile(r"^/fridge/ingredient/remove/\d+"), "/fridge/ingredient/remove/<id>"),
+    (re.compile(r"^/recipe/search\?stream=1"), "/recipe/search?stream=1"),
+]
+
+
+def route_label(method, path):
+    for pattern, label in ROUTE_PATTERNS:
+        if pattern.match(path):
+            return f"{method} {label}"
+    return f"{method} {path.split('?')[0]}"
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+class VirtualUser:
+    """A logged in browser session plus what it has in its fridge."""
+
+    def __init__(self, base_url, username):
+        self.base_url = base_url
+        self.username = username
+        self.http = requests.Session()
+        self.fridge = {}
+        self.lock = threading.Lock()
+
+    def request(self, method, path, body=None):
+        return self.http.request(method, self.base_url + path, json=body, timeout=60)
+
+    def sign_up(self):
+        self.http.post(self.base_url + "/signup", data={
+            "username": self.username,
+            "email": f"{self.username}@bench.example.com",
+            "password": "benchmark",
+            "avatar_img": "",
+            "bio": "benchmark user",
+        }, timeout=60)
+        self.http.post(self.base_url + "/fridge/create", timeout=60)
+
+    def log_in(self, password):
+        self.http.post(self.base_url + "/login", data={
+            "username": self.username,
+            "password": password,
+        }, timeout=60)
+
+
+class Benchmark:
+    def __init__(self, base_url, users, ingredients, rng):
+        self.base_url = base_url
+        self.users = users
+        self.ingredients = ingredients
+        self.rng = rng
+        self.recipe_ids = list(range(1, 200))
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, label, elapsed, ok):
+        with self._lock:
+            self.samples[label].append(elapsed)
+            if not ok:
+                self.errors[label] += 1
+
+    def timed(self, user, method, path, body=None):
+        start = time.perf_counter()
+        try:
+            resp = user.request(method, path, body)
+            ok = resp.status_code < 400
+        except requests.RequestException:
+            resp, ok = None, False
+        self.record(route_label(method, path), time.perf_counter() - start, ok)
+        return resp
+
+    ##################################################################
+    # synthetic traffic
+
+    def synthetic_request(self, user):
+        with self._lock:
+            kind = self.rng.choices([k for _, k in MIX], weights=[w for w, _ in MIX])[0]
+            ing = self.rng.choice(self.ingredients)
+            recipe_id = self.rng.choice(self.recipe_ids)
+
+        if kind == "homepage":
+            self.timed(user, "GET", "/")
+        elif kind == "ingredient_search":
+            query = ing["name"][:self.rng.randint(3, max(len(ing["name"]), 3))]
+            self.timed(user, "GET", f"/ingredient/search/{query}&10")
+        elif kind == "fridge_add":
+            resp = self.timed(user, "POST", "/fridge/ingredients/add",
+                              {"ingredients": [{"ing_id": ing["id"], "ing_name": ing["name"]}]})
+            if resp is not None and resp.ok and isinstance(resp.json(), dict):
+                with user.lock:
+                    for added in resp.json()["added"]:
+                        user.fridge[added["id"]] = added["name"]
+        elif kind == "fridge_remove":
+            with user.lock:
+                ids = list(user.fridge)[:1]
+                for id in ids:
+                    del user.fridge[id]
+            self.timed(user, "POST", "/fridge/ingredients/remove", {"ids": ids})
+        elif kind == "recipe_search":
+            resp = self.timed(user, "GET", "/recipe/search")
+            if resp is not None and resp.ok and isinstance(resp.json(), list):
+                with self._lock:
+                    self.recipe_ids.extend(r["id"] for r in resp.json()[:3] if "id" in r)
+                    del self.recipe_ids[:-500]
+        else:
+            self.timed(user, "GET", f"/recipe/check-out/{recipe_id}")
+
+    ##################################################################
+    # running
+
+    def run_synthetic(self, concurrency, duration, max_requests):
+        deadline = time.monotonic() + duration
+        count = [0]
+
+        def worker(n):
+            user = self.users[n % len(self.users)]
+            while time.monotonic() < deadline:
+                with self._lock:
+                    if max_requests and count[0] >= max_requests:
+                        return
+                    count[0] += 1
+                self.synthetic_request(user)
+
+        return self._run(concurrency, [lambda n=n: worker(n) for n in range(concurrency)])
+
+    def run_trace(self, concurrency, trace_path):
+        def replay(line):
+            entry = json.loads(line)
+            user = self.users[int(entry.get("user", 0)) % len(self.users)]
+            self.timed(user, entry.get("method", "GET"), entry["path"], entry.get("json"))
+
+        with open(trace_path) as trace:
+            lines = [line for line in trace if line.strip()]
+        return self._run(concurrency, [lambda line=line: replay(line) for line in lines])
+
+    def _run(self, concurrency, tasks):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for future in [pool.submit(task) for task in tasks]:
+                future.result()
+        return time.perf_counter() - start
+
+    def report(self, elapsed):
+        """Return {route: stats} plus an "ALL" row, latencies in milliseconds."""
+        rows = {}
+        everything = []
+        for label, samples in self.samples.items():
+            everything.extend(samples)
+            rows[label] = self._stats(sorted(samples), self.errors[label], elapsed)
+        rows["ALL"] = self._stats(sorted(everything), sum(self.errors.values()), elapsed)
+        return rows
+
+    @staticmethod
+    def _stats(samples, errors, elapsed):
+        return {
+            "count": len(samples),
+            "errors": errors,
+            "rps": round(len(samples) / elapsed, 1) if elapsed else 0,
+            "p50": round(percentile(samples, 50) * 1000, 1),
+            "p95": round(percentile(samples, 95) * 1000, 1),
+            "p99": round(percentile(samples, 99) * 1000, 1),
+            "max": round(samples[-1] * 1000, 1) if samples else 0,
+        }
+
+
+def print_report(rows):
+    header = f"{'route':<48}{'count':>8}{'errors':>8}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}"
+    print(header)
+    print("-" * len(header))
+    for label in sorted(rows, key=lambda l: (l == "ALL", l)):
+        r = rows[label]
+        print(f"{label:<48}{r['count']:>8}{r['errors']:>8}{r['rps']:>8}"
+              f"{r['p50']:>9}{r['p95']:>9}{r['p99']:>9}{r['max']:>9}")
+    print("(latencies in ms)")
+
+
+def compare(rows, baseline, tolerance):
+    """Return the routes whose p95 got worse than baseline by more than tolerance."""
+    regressions = []
+    for label, old in baseline.items():
+        new = rows.get(label)
+        if new and old["p95"] and new["p95"] > old["p95"] * (1 + tolerance):
+            regressions.append(f"{label}: p95 {old['p95']}ms -> {new['p95']}ms")
+    return regressions
+
+
+def start_app(database_url, fake_url):
+    """Configure and start the app on a background werkzeug server.
+
+    Return its base url. create_app reads its configuration from the
+    environment, set here first."""
+    os.environ["API_BASE_URL"] = fake_url
+    os.environ.setdefault("API_KEY", "benchmark")
+    os.environ.setdefault("CONFIG_KEY", "benchmark")
+    os.environ["DATABASE_URL"] = database_url
+    # proxy the fake API's images like the real ones
+    os.environ.setdefault("IMAGE_ALLOWED_HOSTS", "127.0.0.1")
+    # the fake has no quota, measure the app rather than our rate limiter
+    os.environ.setdefault("API_RATE_LIMIT", "10000")
+    os.environ.setdefault("API_BURST", "10000")
+
+    from werkzeug.serving import make_server
+    from app import create_app
+    from models import db, Ingredient
+
+    app = create_app({"WTF_CSRF_ENABLED": False, "WARM_UP": False})
+    with app.app_context():
+        db.create_all()
+        if not Ingredient.query.first():
+            with open(fake_spoonacular.INGREDIENTS_CSV) as f:
+                db.session.bulk_insert_mappings(Ingredient, DictReader(f))
+            db.session.commit()
+
+    # one log line per request would swamp the report (and skew timings)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10, help="virtual users to sign up")
+    parser.add_argument("--seeded", action="store_true",
+                        help="log in as generator/generate.py users instead of signing up")
+    parser.add_argument("--concurrency", type=int, default=10, help="requests in flight")
+    parser.add_argument("--duration", type=float, default=20, help="seconds of synthetic traffic")
+    parser.add_argument("--requests", type=int, default=0, help="stop after this many requests")
+    parser.add_argument("--trace", help="JSON lines trace to replay instead of synthetic traffic")
+    parser.add_argument("--latency", type=float, default=0.1, help="fake API seconds per call")
+    parser.add_argument("--jitter", type=float, default=0.02, help="fake API +/- seconds per call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fake API failure rate")
+    parser.add_argument("--database", help="database url (default: a throwaway sqlite file)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--baseline", help="earlier --json report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 regression")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    database = args.database or f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+
+    _, fake = fake_spoonacular.start(
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, seed=args.seed)
+    base_url = start_app(database, fake.base_url)
+    ingredients = fake_spoonacular.load_ingredients()
+
+    if args.seeded:
+        users = [VirtualUser(base_url, username(n)) for n in range(args.users)]
+        start_session = lambda u: u.log_in(PASSWORD)
+    else:
+        users = [VirtualUser(base_url, f"bench_{args.seed}_{n}") for n in range(args.users)]
+        start_session = lambda u: u.sign_up()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(start_session, users))
+
+    bench = Benchmark(base_url, users, ingredients, rng)
+    if args.trace:
+        elapsed = bench.run_trace(args.concurrency, args.trace)
+    else:
+        elapsed = bench.run_synthetic(args.concurrency, args.duration, args.requests)
+
+    rows = bench.report(elapsed)
+    print_report(rows)
+    print(f"{fake.calls} calls reached the fake API in {elapsed:.1f}s")
+
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump(rows, out, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(rows, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
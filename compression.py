@@ -0,0 +1,66 @@
+# gzip compression of responses for clients that accept it
+
+import gzip
+
+from flask import request
+
+COMPRESSIBLE_TYPES = {
+    "text/html",
+    "text/css",
+    "text/plain",
+    "text/javascript",
+    "application/javascript",
+    "application/json",
+    "image/svg+xml",
+}
+
+
+class Compress:
+    """Gzip text responses larger than COMPRESS_MIN_SIZE bytes.
+
+    - only when the request's Accept-Encoding allows gzip
+    - never streamed responses (compressing would buffer them), 304s and
+      other bodiless statuses, or responses already encoded
+    - compressible types always get Vary: Accept-Encoding, so shared
+      caches keep the plain and gzipped copies apart
+
+    COMPRESS_LEVEL trades CPU for bytes; 6 is zlib's usual default.
+    """
+
+    def __init__(self, min_size=500, level=6):
+        self.min_size = min_size
+        self.level = level
+
+    def init_app(self, app):
+        self.min_size = int(app.config.get("COMPRESS_MIN_SIZE", self.min_size))
+        self.level = int(app.config.get("COMPRESS_LEVEL", self.level))
+        app.after_request(self.after_request)
+
+    def after_request(self, response):
+        if response.mimetype not in COMPRESSIBLE_TYPES:
+            return response
+        response.vary.add("Accept-Encoding")
+
+        if (
+            response.status_code < 200
+            or response.status_code in (204, 304)
+            or response.is_streamed
+            or response.direct_passthrough
+            or "Content-Encoding" in response.headers
+            or not request.accept_encodings["gzip"]
+        ):
+            return response
+
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+        response.set_data(gzip.compress(data, self.level))
+        response.headers["Content-Encoding"] = "gzip"
+        # the gzipped bytes differ, so a strong validator no longer holds
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+
+compress = Compress()
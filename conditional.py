@@ -0,0 +1,58 @@
+# conditional GET support: ETag / Last-Modified and 304 Not Modified
+
+import hashlib
+import os
+
+from flask import Response, make_response, request, session
+
+# a new release may change templates, so it changes every ETag too
+RELEASE = os.environ.get("HEROKU_RELEASE_VERSION", "")
+
+
+def page_etag(*parts):
+    """Weak ETag value for a page built from parts (anything with a stable repr)."""
+    return hashlib.sha1(repr((RELEASE,) + parts).encode()).hexdigest()[:32]
+
+
+def is_not_modified(etag, last_modified):
+    """True if the client's copy, per If-None-Match / If-Modified-Since, is current.
+
+    If-None-Match wins when both are sent, as HTTP says it should."""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    since = request.if_modified_since
+    return since is not None and last_modified is not None and \
+        last_modified.replace(microsecond=0) <= since
+
+
+def _validators(response, etag, last_modified, max_age):
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # pages behind a login: only the browser may keep them, never a shared cache
+    response.cache_control.private = True
+    if max_age:
+        response.cache_control.max_age = max_age
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+
+def conditional(etag, last_modified, render, max_age=0):
+    """Answer 304 if the client's copy is current, else render() with validators.
+
+    - etag: from page_etag; covers everything the page shows
+    - last_modified: naive UTC datetime of the newest thing on the page
+    - render: returns the response body (or anything make_response takes)
+    - max_age: seconds the browser may reuse its copy without asking;
+      0 means it revalidates every time
+
+    Pages with flashed messages pending always render, since showing
+    them is what empties the queue and they aren't part of the ETag.
+    """
+    if session.get("_flashes"):
+        return render()
+    if is_not_modified(etag, last_modified):
+        return _validators(Response(status=304), etag, last_modified, max_age)
+    return _validators(make_response(render()), etag, last_modified, max_age)
+
@@ -0,0 +1,100 @@
+# app configuration, read from the environment by create_app
+
+import os
+
+
+def _int(env, name, default):
+    return int(env.get(name) or default)
+
+
+def _float(env, name, default):
+    return float(env.get(name) or default)
+
+
+def from_env(environ=None):
+    """Return the app's config dict built from environ (default os.environ).
+
+    FLASK_ENV=development turns on SQL echo and the debug toolbar. Values
+    left unset here (None) fall back to the defaults of the extension
+    that reads them, see its init_app.
+    """
+    env = os.environ if environ is None else environ
+    dev = env.get("FLASK_ENV") == "development"
+    return {
+        "SQLALCHEMY_DATABASE_URI": env.get("DATABASE_URL", "postgresql:///cookwhat"),
+        "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+        "SQLALCHEMY_ECHO": dev,
+        # pooled connections per worker; pre-ping replaces connections the
+        # server closed instead of failing the request that draws one
+        "SQLALCHEMY_ENGINE_OPTIONS": {
+            "pool_size": _int(env, "DB_POOL_SIZE", 5),
+            "max_overflow": _int(env, "DB_MAX_OVERFLOW", 5),
+            "pool_timeout": _float(env, "DB_POOL_TIMEOUT", 10),
+            "pool_recycle": _int(env, "DB_POOL_RECYCLE", 1800),
+            "pool_pre_ping": env.get("DB_POOL_PRE_PING", "1") != "0",
+        },
+        # plain reads go to REPLICA_DATABASE_URL if set, see db_routing
+        "SQLALCHEMY_BINDS": (
+            {"replica": env["REPLICA_DATABASE_URL"]} if env.get("REPLICA_DATABASE_URL") else None),
+        "REPLICA_PIN_SECONDS": _int(env, "REPLICA_PIN_SECONDS", 10),
+
+        "SECRET_KEY": env.get("CONFIG_KEY") or ("placeholder" if dev else None),
+        "DEBUG_TB_ENABLED": dev,
+        "DEBUG_TB_INTERCEPT_REDIRECTS": False,
+        # build caches and compile templates in create_app, so gunicorn
+        # --preload workers fork with them already in memory
+        "WARM_UP": env.get("WARM_UP", "1") != "0",
+
+        # Spoonacular; point API_BASE_URL at fake_spoonacular.py to
+        # benchmark or test without the real API
+        "API_KEY": env.get("API_KEY", "placeholder" if dev else None),
+        "API_BASE_URL": env.get("API_BASE_URL", "https://api.spoonacular.com/"),
+        # keep-alive connections to the API per worker, raise it with gevent
+        "API_POOL_SIZE": _int(env, "API_POOL_SIZE", 20),
+        # rate limit and daily quota, shared by the workers through a file
+        # in API_LIMIT_STATE_DIR, and the breaker; see upstream_guard
+        "API_RATE_LIMIT": env.get("API_RATE_LIMIT"),
+        "API_BURST": env.get("API_BURST"),
+        "API_DAILY_QUOTA": env.get("API_DAILY_QUOTA"),
+        "API_LIMIT_STATE_DIR": env.get("API_LIMIT_STATE_DIR"),
+        "API_BREAKER_THRESHOLD": env.get("API_BREAKER_THRESHOLD"),
+        "API_BREAKER_RESET": env.get("API_BREAKER_RESET"),
+        # workers on one host share identical in-flight API calls through
+        # lock files here, see single_flight
+        "SINGLE_FLIGHT_LOCK_DIR": env.get("SINGLE_FLIGHT_LOCK_DIR"),
+
+        # bcrypt work factor for new password hashes, logins rehash older ones
+        "BCRYPT_LOG_ROUNDS": _int(env, "BCRYPT_LOG_ROUNDS", 12),
+        "BCRYPT_WORKERS": _int(env, "BCRYPT_WORKERS", 2),
+
+        # timings at /metrics; METRICS_SAMPLE_RATE=0 turns the hooks off entirely
+        "METRICS_SAMPLE_RATE": _float(env, "METRICS_SAMPLE_RATE", 1.0),
+        "SLOW_REQUEST_MS": _float(env, "SLOW_REQUEST_MS", 1000),
+        # bearer token /metrics requires; without it /metrics is refused,
+        # unless in development
+        "METRICS_TOKEN": env.get("METRICS_TOKEN"),
+
+        # gzip text responses bigger than COMPRESS_MIN_SIZE bytes
+        "COMPRESS_MIN_SIZE": _int(env, "COMPRESS_MIN_SIZE", 500),
+        "COMPRESS_LEVEL": _int(env, "COMPRESS_LEVEL", 6),
+
+        # recipe images are served from /img/<key> out of a local disk cache
+        "IMAGE_CACHE_DIR": env.get("IMAGE_CACHE_DIR"),
+        "IMAGE_CACHE_MAX_BYTES": env.get("IMAGE_CACHE_MAX_BYTES"),
+        "IMAGE_ALLOWED_HOSTS": env.get("IMAGE_ALLOWED_HOSTS"),
+
+        # JSON lines file of recipes (Spoonacular recipe information, one
+        # per line) searched locally along with the ones we've stored
+        "RECIPE_CORPUS": env.get("RECIPE_CORPUS"),
+
+        # recipes for each fridge are searched in the background after it
+        # changes, RECOMMEND_DEBOUNCE seconds after the last edit
+        "RECOMMEND_DEBOUNCE": _float(env, "RECOMMEND_DEBOUNCE", 2),
+        "RECOMMEND_WORKERS": _int(env, "RECOMMEND_WORKERS", 2),
+
+        # details of the top PREFETCH_NUMBER recipes of each search are
+        # fetched in the background, ready for check-out
+        "PREFETCH_NUMBER": _int(env, "PREFETCH_NUMBER", 5),
+        "PREFETCH_WORKERS": _int(env, "PREFETCH_WORKERS", 2),
+        "PREFETCH_QUEUE": _int(env, "PREFETCH_QUEUE", 50),
+    }
@@ -0,0 +1,90 @@
+# Flask-SQLAlchemy with reads sent to a replica and writes to the primary
+
+import time
+
+from flask import g, has_request_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import orm
+from sqlalchemy.sql.expression import CompoundSelect, Select
+
+REPLICA_BIND = "replica"
+# holds the time until which this browser's reads stay on the primary
+PIN_COOKIE = "cw_db_primary"
+
+# QueuePool only; sqlite gets NullPool or StaticPool, which refuse them
+QUEUE_POOL_OPTIONS = ("pool_size", "max_overflow", "pool_timeout")
+
+
+class RoutingSession(SignallingSession):
+    """Session that sends plain SELECTs to the "replica" bind, if there is one.
+
+    Everything else goes to the primary: flushes, INSERT/UPDATE/DELETE,
+    SELECT ... FOR UPDATE, raw SQL and bare session.connection() calls.
+    Once the session has written, its reads go to the primary too, so it
+    always sees its own writes. So do a browser's requests for
+    REPLICA_PIN_SECONDS after one of its requests wrote (see
+    RoutingSQLAlchemy), which covers the replica's lag.
+    """
+
+    def __init__(self, db, **options):
+        self._wrote = False
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._use_replica(clause):
+            state = get_state(self.app)
+            return state.db.get_engine(self.app, bind=REPLICA_BIND)
+        if self._flushing or not _is_read(clause):
+            self._wrote = True
+            if has_request_context():
+                g.db_wrote = True
+        return super().get_bind(mapper, clause)
+
+    def _use_replica(self, clause):
+        if self._wrote or self._flushing or not _is_read(clause):
+            return False
+        if REPLICA_BIND not in (self.app.config.get("SQLALCHEMY_BINDS") or {}):
+            return False
+        if has_request_context():
+            try:
+                return float(request.cookies.get(PIN_COOKIE, 0)) < time.time()
+            except ValueError:
+                return True
+        return True
+
+
+def _is_read(clause):
+    return isinstance(clause, (Select, CompoundSelect)) and clause._for_update_arg is None
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy with RoutingSession and per-app pool settings.
+
+    - SQLALCHEMY_BINDS["replica"]: url of a read replica of the primary
+    - REPLICA_PIN_SECONDS: how long a browser reads from the primary
+      after it wrote, via a cookie; set it above the replica's usual lag
+    - SQLALCHEMY_ENGINE_OPTIONS applies to the primary and the replica;
+      QueuePool sizing is dropped for sqlite, which doesn't use one
+    """
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def init_app(self, app):
+        super().init_app(app)
+        app.config.setdefault("REPLICA_PIN_SECONDS", 10)
+        app.after_request(self._pin_to_primary)
+
+    def create_engine(self, sa_url, engine_opts):
+        if sa_url.drivername.startswith("sqlite"):
+            engine_opts = {k: v for k, v in engine_opts.items() if k not in QUEUE_POOL_OPTIONS}
+        return super().create_engine(sa_url, engine_opts)
+
+    def _pin_to_primary(self, response):
+        if g.get("db_wrote"):
+            app = self.get_app()
+            seconds = int(app.config["REPLICA_PIN_SECONDS"])
+            if REPLICA_BIND in (app.config.get("SQLALCHEMY_BINDS") or {}) and seconds:
+                response.set_cookie(PIN_COOKIE, str(int(time.time() + seconds)),
+                                    max_age=seconds, httponly=True, samesite="Lax")
+        return response
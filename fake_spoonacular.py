@@ -0,0 +1,252 @@
+"""Local stand-in for the parts of the Spoonacular API the app uses.
+
+Answers the same endpoints with deterministic, realistic looking data
+built from generator/ingredients.csv, after a configurable delay, so the
+app can be benchmarked and tested without network access or API quota.
+
+    python fake_spoonacular.py --port 9000 --latency 0.2 --jitter 0.05
+
+then run the app with API_BASE_URL=http://127.0.0.1:9000/
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from csv import DictReader
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+INGREDIENTS_CSV = "generator/ingredients.csv"
+
+# smallest valid 1x1 gif, served for every recipe and ingredient image
+PIXEL_GIF = (
+    b"GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00"
+    b"\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;"
+)
+
+DISHES = ["Salad", "Soup", "Stir Fry", "Casserole", "Tacos", "Pasta", "Curry",
+          "Sandwich", "Frittata", "Stew", "Bowl", "Skillet", "Pie", "Smoothie"]
+
+
+def load_ingredients(path=INGREDIENTS_CSV):
+    with open(path) as f:
+        return [{"id": int(row["id"]), "name": row["name"]} for row in DictReader(f)]
+
+
+class FakeSpoonacular:
+    """Deterministic fake data plus the knobs the benchmark turns.
+
+    - latency / jitter: seconds added to every response
+    - error_rate: fraction of API calls answered with a 500 failure body
+    - steps / ingredients_per_recipe: payload size of recipe details
+    """
+
+    def __init__(self, ingredients, latency=0.0, jitter=0.0, error_rate=0.0,
+                 steps=8, ingredients_per_recipe=10, seed=0):
+        self.ingredients = ingredients
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.steps = steps
+        self.ingredients_per_recipe = ingredients_per_recipe
+        self.seed = seed
+        self.base_url = ""
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+
+    def _random(self, *key):
+        """Random generator seeded from key, so answers never change."""
+        return random.Random(zlib.crc32(repr((self.seed,) + key).encode()))
+
+    def delay(self):
+        with self._lock:
+            self.calls += 1
+            fail = self._rng.random() < self.error_rate
+            pause = self.latency + self._rng.uniform(-self.jitter, self.jitter)
+        time.sleep(max(pause, 0))
+        return fail
+
+    def image(self, id):
+        return f"{self.base_url}recipeImages/{id}-312x231.jpg"
+
+    def recipe_ingredients(self, id):
+        rng = self._random("recipe", id)
+        return rng.sample(self.ingredients, min(self.ingredients_per_recipe, len(self.ingredients)))
+
+    def recipe_title(self, id):
+        rng = self._random("title", id)
+        main = rng.choice(self.recipe_ingredients(id))["name"].title()
+        return f"{main} {rng.choice(DISHES)}"
+
+    def find_by_ingredients(self, ingredients, number):
+        names = {n.strip().lower() for n in ingredients.split(",") if n.strip()}
+        rng = self._random("search", tuple(sorted(names)))
+        results = []
+        for id in rng.sample(range(1, 1000000), number):
+            ings = self.recipe_ingredients(id)
+            used = [i for i in ings if i["name"] in names] or ings[:1]
+            missed = [i for i in ings if i not in used]
+            results.append({
+                "id": id,
+                "title": self.recipe_title(id),
+                "image": self.image(id),
+                "imageType": "jpg",
+                "likes": rng.randint(0, 500),
+                "usedIngredientCount": len(used),
+                "missedIngredientCount": len(missed),
+                "usedIngredients": [dict(i, amount=1, unit="") for i in used],
+                "missedIngredients": [dict(i, amount=1, unit="") for i in missed],
+                "unusedIngredients": [],
+            })
+        return results
+
+    def information(self, id):
+        rng = self._random("info", id)
+        return {
+            "id": id,
+            "title": self.recipe_title(id),
+            "image": self.image(id),
+            "servings": rng.randint(1, 8),
+            "readyInMinutes": rng.choice([10, 15, 20, 30, 45, 60, 90]),
+            "sourceName": "Fake Kitchen",
+            "sourceUrl": f"https://example.com/recipes/{id}",
+            "aggregateLikes": rng.randint(0, 500),
+            "extendedIngredients": [
+                dict(i, original=f"{rng.randint(1, 4)} cups {i['name']}")
+                for i in self.recipe_ingredients(id)
+            ],
+        }
+
+    def analyzed_instructions(self, id):
+        ings = self.recipe_ingredients(id)
+        steps = [
+            {"number": n, "step": f"Step {n}: add the {ings[n % len(ings)]['name']} and stir well."}
+            for n in range(1, self.steps + 1)
+        ]
+        return [{"name": "", "steps": steps}]
+
+    def ingredient_search(self, query, number):
+        query = query.strip().lower()
+        matches = [i for i in self.ingredients if query in i["name"]]
+        matches.sort(key=lambda i: (not i["name"].startswith(query), len(i["name"])))
+        return {
+            "results": [dict(i, image=f"{i['name'].replace(' ', '-')}.jpg") for i in matches[:number]],
+            "offset": 0,
+            "number": number,
+            "totalResults": len(matches),
+        }
+
+    def route(self, path, params):
+        """Return (status, body) for an API path, or None if unknown."""
+        if path == "/recipes/findByIngredients":
+            return 200, self.find_by_ingredients(
+                params.get("ingredients", ""), int(params.get("number", 10)))
+        if path == "/food/ingredients/search":
+            return 200, self.ingredient_search(
+                params.get("query", ""), int(params.get("number", 10)))
+        match = re.fullmatch(r"/recipes/(\d+)/(information|analyzedInstructions)", path)
+        if match:
+            id = int(match.group(1))
+            if match.group(2) == "information":
+                return 200, self.information(id)
+            return 200, self.analyzed_instructions(id)
+        return None
+
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+            if url.path.startswith("/recipeImages/") or url.path.startswith("/cdn/"):
+                return self.send(200, PIXEL_GIF, "image/gif")
+
+            if url.path == "/imageRedirect":
+                # a CDN sending the image elsewhere
+                self.send_response(302)
+                self.send_header("Location", params.get("to", "/"))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            if not params.get("apiKey"):
+                return self.send_json(401, {"status": "failure", "code": 401,
+                                            "message": "You are not authorized."})
+
+            fail = fake.delay()
+            answer = fake.route(url.path, params)
+            if answer is None:
+                return self.send_json(404, {"status": "failure", "code": 404,
+                                            "message": "Not found."})
+            if fail:
+                return self.send_json(500, {"status": "failure", "code": 500,
+                                            "message": "Injected failure."})
+            self.send_json(*answer)
+
+        def send_json(self, status, body):
+            self.send(status, json.dumps(body).encode(), "application/json")
+
+        def send(self, status, payload, content_type):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # the default backlog of 5 drops connections when hundreds arrive at once
+    request_queue_size = 1024
+
+
+def start(port=0, host="127.0.0.1", **options):
+    """Start a fake API server on a background thread.
+
+    Return (server, fake); server.server_address has the real port and
+    fake.base_url the url to point API_BASE_URL at."""
+    fake = FakeSpoonacular(load_ingredients(), **options)
+    server = FakeServer((host, port), make_handler(fake))
+    fake.base_url = f"http://{host}:{server.server_address[1]}/"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, fake
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per call")
+    parser.add_argument("--jitter", type=float, default=0.0, help="+/- seconds per call")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--steps", type=int, default=8, help="instruction steps per recipe")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server, fake = start(
+        args.port, args.host, latency=args.latency, jitter=args.jitter,
+        error_rate=args.error_rate, steps=args.steps, seed=args.seed,
+    )
+    print(f"fake Spoonacular listening on {fake.base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,172 @@
 # methods for the fridge
-from models import Fridge
+#
+# Each of these runs a single query and hands back plain row tuples
+# (id, ing_id, name) rather than ORM objects, so callers never trigger
+# lazy loads and don't drag session state around.
 
+from collections import namedtuple
+from datetime import datetime
+from models import db, Fridge, Fridge_Ingredients
 
-def check_for_fridge(user_id):
-    """Check if user already has a fridge created.
+FridgeContents = namedtuple("FridgeContents", ["id", "ingredients"])
+FridgeItem = namedtuple("FridgeItem", ["id", "ing_id", "name"])
+FridgeState = namedtuple("FridgeState", ["id", "version", "updated_at"])
 
-    - If they do, return an instance of the fridge
 
-    - If they do not, return None
+def _ingredient_columns():
+    return (Fridge_Ingredients.id, Fridge_Ingredients.ing_id, Fridge_Ingredients.name)
+
+
+def get_fridge_id(user_id):
+    """Return the id of the user's fridge, or None if they have none."""
+    return db.session.query(Fridge.id).filter(Fridge.user_id == user_id).scalar()
+
+
+def get_fridge_state(user_id):
+    """Return FridgeState(id, version, updated_at) of the user's fridge, or None.
+
+    Enough to tell whether anything cached for the fridge is still current."""
+    row = (
+        db.session.query(Fridge.id, Fridge.version, Fridge.updated_at)
+        .filter(Fridge.user_id == user_id)
+        .first()
+    )
+    return FridgeState(*row) if row else None
+
+
+def bump_fridge_version(*criteria):
+    """Mark the fridge(s) matching criteria as changed. Caller commits.
+
+    Done in the same transaction as the change, so a version is never
+    seen without the contents it stands for."""
+    Fridge.query.filter(*criteria).update(
+        {Fridge.version: Fridge.version + 1, Fridge.updated_at: datetime.utcnow()},
+        synchronize_session=False,
+    )
+
+
+def get_fridge_contents(user_id):
+    """Return FridgeContents(id, ingredients) for the user's fridge.
+
+    Fridge and ingredients come back from one outer join.
+
+    - If they have no fridge, return None
     """
-    try:
-        fridge = Fridge.query.filter_by(user_id=user_id).one()
-        return fridge
-    except:
+    rows = (
+        db.session.query(Fridge.id.label("fridge_id"), *_ingredient_columns())
+        .outerjoin(Fridge_Ingredients, Fridge_Ingredients.fridge_id == Fridge.id)
+        .filter(Fridge.user_id == user_id)
+        .order_by(Fridge_Ingredients.id)
+        .all()
+    )
+    if not rows:
         return None
+    ingredients = [FridgeItem(*row[1:]) for row in rows if row.id is not None]
+    return FridgeContents(rows[0].fridge_id, ingredients)
+
+
+def get_fridge_ingredients(user_id):
+    """Return (id, ing_id, name) rows for everything in the user's fridge."""
+    return (
+        db.session.query(*_ingredient_columns())
+        .join(Fridge, Fridge.id == Fridge_Ingredients.fridge_id)
+        .filter(Fridge.user_id == user_id)
+        .order_by(Fridge_Ingredients.id)
+        .all()
+    )
+
+
+def ingredients_query(items):
+    """Comma separated names of items, the way the recipe search API wants them."""
+    return ','.join(item.name for item in items if item.name)
+
+
+def find_fridge_ingredient(user_id, ing_id):
+    """Return the fridge ingredient id of ing_id in the user's fridge, or None."""
+    return (
+        db.session.query(Fridge_Ingredients.id)
+        .join(Fridge, Fridge.id == Fridge_Ingredients.fridge_id)
+        .filter(Fridge.user_id == user_id, Fridge_Ingredients.ing_id == ing_id)
+        .scalar()
+    )
+
+
+def add_fridge_ingredient(fridge_id, ing_id, name):
+    """Add ingredient to fridge of given id. Caller commits."""
+    fridge_ing = _new_fridge_ingredient(fridge_id, ing_id, name)
+    bump_fridge_version(Fridge.id == fridge_id)
+    return fridge_ing
+
+
+def _new_fridge_ingredient(fridge_id, ing_id, name):
+    fridge_ing = Fridge_Ingredients(fridge_id=fridge_id, ing_id=ing_id, name=name)
+    db.session.add(fridge_ing)
+    return fridge_ing
+
+
+def add_fridge_ingredients(fridge_id, items):
+    """Add many (ing_id, name) pairs to fridge of given id. Caller commits.
+
+    Ingredients already in the fridge (or repeated in items) are skipped.
+    Return (added, existing): FridgeItem lists of the new rows, with ids
+    assigned, and of the rows that were already there.
+    """
+    if not items:
+        return [], []
+    ing_ids = {ing_id for ing_id, _ in items}
+    existing = [
+        FridgeItem(*row)
+        for row in db.session.query(*_ingredient_columns())
+        .filter(Fridge_Ingredients.fridge_id == fridge_id, Fridge_Ingredients.ing_id.in_(ing_ids))
+    ]
+
+    seen = {item.ing_id for item in existing}
+    new_rows = []
+    for ing_id, name in items:
+        if ing_id not in seen:
+            seen.add(ing_id)
+            new_rows.append(_new_fridge_ingredient(fridge_id, ing_id, name))
+    if new_rows:
+        bump_fridge_version(Fridge.id == fridge_id)
+    # assign ids without committing, so the caller's commit covers the batch
+    db.session.flush()
+
+    added = [FridgeItem(r.id, r.ing_id, r.name) for r in new_rows]
+    return added, existing
+
+
+def remove_fridge_ingredients(user_id, ids):
+    """Delete every fridge ingredient in ids that's in the user's fridge.
+
+    Return the ids that were removed. Caller commits.
+    """
+    if not ids:
+        return []
+    users_fridge = db.session.query(Fridge.id).filter(Fridge.user_id == user_id).subquery()
+    in_users_fridge = db.and_(
+        Fridge_Ingredients.id.in_(ids), Fridge_Ingredients.fridge_id.in_(users_fridge)
+    )
+    removed = [id for id, in db.session.query(Fridge_Ingredients.id).filter(in_users_fridge)]
+    if removed:
+        Fridge_Ingredients.query.filter(
+            Fridge_Ingredients.id.in_(removed)
+        ).delete(synchronize_session=False)
+        bump_fridge_version(Fridge.user_id == user_id)
+    return removed
+
+
+def remove_fridge_ingredient(user_id, id):
+    """Delete fridge ingredient of given id if it's in the user's fridge.
+
+    Done as a single DELETE (plus the version bump if it removed anything);
+    return the number of rows removed. Caller commits.
+    """
+    users_fridge = db.session.query(Fridge.id).filter(Fridge.user_id == user_id)
+    removed = (
+        Fridge_Ingredients.query
+        .filter(Fridge_Ingredients.id == id, Fridge_Ingredients.fridge_id.in_(users_fridge.subquery()))
+        .delete(synchronize_session=False)
+    )
+    if removed:
+        bump_fridge_version(Fridge.user_id == user_id)
+    return removed
@@ -0,0 +1,220 @@
+"""Generate a synthetic dataset of users, fridges and fridge contents.
+
+Writes CSVs that seed.py loads, plus a JSON lines request trace that
+benchmark.py replays. Output is streamed row by row, so millions of users
+don't need to fit in memory, and is fully determined by --seed.
+
+- users.csv: id, username, email, password (plaintext), avatar_img, bio
+- fridges.csv: id, user_id (one fridge per user)
+- fridge_ingredients.csv: id, fridge_id, ing_id, name
+- traces.jsonl: {"user": n, "method", "path", "json"} requests
+
+Ingredient popularity follows a Zipf distribution (a few staples are in
+almost every fridge, most ingredients are rare) and fridge sizes a
+lognormal one, which is roughly what real pantries look like.
+
+    python generator/generate.py --users 100000 --out generator/synthetic
+    python seed.py --users generator/synthetic/users.csv \\
+        --fridges generator/synthetic/fridges.csv \\
+        --fridge-ingredients generator/synthetic/fridge_ingredients.csv --rounds 4
+    python benchmark.py --database $DATABASE_URL --seeded --users 100 \\
+        --trace generator/synthetic/traces.jsonl
+"""
+
+import argparse
+import csv
+import json
+import math
+import os
+import random
+from bisect import bisect_right
+from itertools import accumulate
+
+INGREDIENTS_CSV = "generator/ingredients.csv"
+PASSWORD = "cookwhat"
+AVATAR = "https://st2.depositphotos.com/1341440/7182/v/600/depositphotos_71824861-stock-illustration-chef-hat-vector-black-silhouette.jpg"
+
+# (weight, request kind) of the generated traces, as in benchmark.py
+TRACE_MIX = [
+    (30, "homepage"),
+    (20, "ingredient_search"),
+    (10, "fridge_add"),
+    (5, "fridge_remove"),
+    (15, "recipe_search"),
+    (20, "recipe_check_out"),
+]
+
+
+def username(n):
+    """Username of the nth generated user; benchmark.py --seeded logs in as these."""
+    return f"user_{n}"
+
+
+def load_ingredients(path=INGREDIENTS_CSV):
+    with open(path, newline="") as f:
+        return [(int(row["id"]), row["name"]) for row in csv.DictReader(f)]
+
+
+class Zipf:
+    """Draw items with probability proportional to 1 / rank ** exponent.
+
+    Ranks are a seeded shuffle of items, so popularity isn't alphabetical."""
+
+    def __init__(self, items, exponent, rng):
+        self.items = list(items)
+        rng.shuffle(self.items)
+        self.cum_weights = list(accumulate(1 / rank ** exponent
+                                           for rank in range(1, len(self.items) + 1)))
+        self.rng = rng
+
+    def draw(self):
+        x = self.rng.random() * self.cum_weights[-1]
+        return self.items[min(bisect_right(self.cum_weights, x), len(self.items) - 1)]
+
+    def sample(self, k):
+        """Draw k distinct items (fewer if there aren't that many)."""
+        k = min(k, len(self.items))
+        chosen = {}
+        for _ in range(k * 20):
+            if len(chosen) == k:
+                break
+            item = self.draw()
+            chosen.setdefault(item[0], item)
+        return list(chosen.values())
+
+
+class Generator:
+    def __init__(self, ingredients, seed=0, exponent=1.1, mean_items=15, max_items=120,
+                 password=PASSWORD):
+        self.rng = random.Random(seed)
+        self.popular = Zipf(ingredients, exponent, self.rng)
+        # lognormal with the requested mean and a long tail of well stocked fridges
+        self.sigma = 0.8
+        self.mu = math.log(max(mean_items, 1)) - self.sigma ** 2 / 2
+        self.max_items = max_items
+        self.password = password
+
+    def fridge_size(self):
+        return min(int(self.rng.lognormvariate(self.mu, self.sigma)), self.max_items)
+
+    def rows(self, users):
+        """Yield (user, fridge, [fridge_ingredient, ...]) rows for each user."""
+        item_id = 0
+        for n in range(users):
+            id = n + 1
+            name = username(n)
+            user = (id, name, f"{name}@example.com", self.password, AVATAR,
+                    f"Synthetic user {n}")
+            fridge = (id, id)
+            items = []
+            for ing_id, ing_name in self.popular.sample(self.fridge_size()):
+                item_id += 1
+                items.append((item_id, id, ing_id, ing_name))
+            yield user, fridge, items
+
+
+class TraceBuilder:
+    """Requests for the first trace_users users, in benchmark.py's trace format.
+
+    Tracks what's in each of those fridges so removes name real rows."""
+
+    def __init__(self, trace_users, ingredients, seed=0, exponent=1.1):
+        self.rng = random.Random(f"{seed}-traces")
+        self.popular = Zipf(ingredients, exponent, random.Random(seed))
+        self.trace_users = trace_users
+        self.fridges = {}
+        # check-outs concentrate on a Zipf subset of recipe ids too
+        self.recipes = Zipf([(id, None) for id in range(1, 5001)], exponent, self.rng)
+
+    def track(self, n, items):
+        if n < self.trace_users:
+            self.fridges[n] = [item[0] for item in items]
+
+    def entry(self):
+        user = self.rng.randrange(max(min(self.trace_users, len(self.fridges)), 1))
+        kind = self.rng.choices([k for _, k in TRACE_MIX], weights=[w for w, _ in TRACE_MIX])[0]
+        fridge = self.fridges.get(user, [])
+
+        if kind == "fridge_remove" and not fridge:
+            kind = "fridge_add"
+
+        if kind == "homepage":
+            return self._request(user, "GET", "/")
+        if kind == "ingredient_search":
+            _, name = self.popular.draw()
+            query = name[:self.rng.randint(3, max(len(name), 3))]
+            return self._request(user, "GET", f"/ingredient/search/{query}&10")
+        if kind == "fridge_add":
+            ing_id, name = self.popular.draw()
+            return self._request(user, "POST", "/fridge/ingredients/add",
+                                 {"ingredients": [{"ing_id": ing_id, "ing_name": name}]})
+        if kind == "fridge_remove":
+            id = fridge.pop(self.rng.randrange(len(fridge)))
+            return self._request(user, "POST", "/fridge/ingredients/remove", {"ids": [id]})
+        if kind == "recipe_search":
+            return self._request(user, "GET", "/recipe/search")
+        return self._request(user, "GET", f"/recipe/check-out/{self.recipes.draw()[0]}")
+
+    @staticmethod
+    def _request(user, method, path, body=None):
+        return {"user": user, "method": method, "path": path, "json": body}
+
+
+def generate(out, users, requests, seed=0, exponent=1.1, mean_items=15, max_items=120,
+             trace_users=100, ingredients_csv=INGREDIENTS_CSV):
+    """Write the dataset to the out directory and return row counts per file."""
+    os.makedirs(out, exist_ok=True)
+    ingredients = load_ingredients(ingredients_csv)
+    generator = Generator(ingredients, seed, exponent, mean_items, max_items)
+    traces = TraceBuilder(trace_users, ingredients, seed, exponent)
+    counts = {"users.csv": 0, "fridges.csv": 0, "fridge_ingredients.csv": 0, "traces.jsonl": 0}
+
+    with open(os.path.join(out, "users.csv"), "w", newline="") as users_file, \
+            open(os.path.join(out, "fridges.csv"), "w", newline="") as fridges_file, \
+            open(os.path.join(out, "fridge_ingredients.csv"), "w", newline="") as items_file:
+        users_csv = csv.writer(users_file)
+        fridges_csv = csv.writer(fridges_file)
+        items_csv = csv.writer(items_file)
+        users_csv.writerow(("id", "username", "email", "password", "avatar_img", "bio"))
+        fridges_csv.writerow(("id", "user_id"))
+        items_csv.writerow(("id", "fridge_id", "ing_id", "name"))
+
+        for n, (user, fridge, items) in enumerate(generator.rows(users)):
+            users_csv.writerow(user)
+            fridges_csv.writerow(fridge)
+            items_csv.writerows(items)
+            traces.track(n, items)
+            counts["users.csv"] += 1
+            counts["fridges.csv"] += 1
+            counts["fridge_ingredients.csv"] += len(items)
+
+    with open(os.path.join(out, "traces.jsonl"), "w") as trace_file:
+        for _ in range(requests):
+            trace_file.write(json.dumps(traces.entry()) + "\n")
+            counts["traces.jsonl"] += 1
+
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=10000, help="trace length")
+    parser.add_argument("--trace-users", type=int, default=100,
+                        help="users the trace acts as (benchmark.py --seeded --users)")
+    parser.add_argument("--mean-items", type=float, default=15, help="average fridge size")
+    parser.add_argument("--max-items", type=int, default=120, help="largest fridge")
+    parser.add_argument("--zipf", type=float, default=1.1, help="popularity skew exponent")
+    parser.add_argument("--ingredients", default=INGREDIENTS_CSV)
+    parser.add_argument("--out", default="generator/synthetic")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    counts = generate(args.out, args.users, args.requests, args.seed, args.zipf,
+                      args.mean_items, args.max_items, args.trace_users, args.ingredients)
+    for name, count in counts.items():
+        print(f"{os.path.join(args.out, name)}: {count} rows")
+
+
+if __name__ == "__main__":
+    main()
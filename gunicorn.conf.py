@@ -0,0 +1,36 @@
+# gunicorn settings, read by `gunicorn -c gunicorn.conf.py --preload "app:create_app()"`
+
+import gc
+import os
+
+# Most requests spend their time waiting on Spoonacular or the database.
+# "gevent" workers (the default) serve up to worker_connections requests
+# each while they wait; "gthread" does the same on a bounded pool of
+# `threads` real threads; "sync" is one request per worker.
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gevent")
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+threads = int(os.environ.get("GUNICORN_THREADS", 16))
+worker_connections = int(os.environ.get("GUNICORN_CONNECTIONS", 500))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+keepalive = 5
+
+if worker_class == "gevent":
+    # Patch here, in the master, before the app is imported (also with
+    # --preload), so its module level locks, thread pools and sockets are
+    # all cooperative. psycopg2 is a C extension monkey patching can't
+    # reach; psycogreen makes its queries yield to other greenlets too.
+    from gevent import monkey
+
+    monkey.patch_all()
+
+    from psycogreen.gevent import patch_psycopg
+
+    patch_psycopg()
+
+
+def pre_fork(server, worker):
+    # With --preload the app (and what warm_up built) is created once in
+    # the master and shared copy-on-write. Freezing moves it out of the
+    # garbage collector's reach, so collections in a worker don't write
+    # to (and thereby copy) those shared pages.
+    gc.freeze()
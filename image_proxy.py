@@ -0,0 +1,257 @@
+# recipe image proxy backed by a content-addressed disk cache
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urljoin, urlparse
+
+import requests
+from flask import abort, send_file
+
+from single_flight import single_flight
+
+DEFAULT_ALLOWED_HOSTS = ("spoonacular.com",)
+
+# a year; an image url's bytes never change, and the cache is keyed by url
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+
+# redirects followed per fetch, each to an allowed host only
+MAX_REDIRECTS = 3
+
+
+class ImageProxy:
+    """Serve third party images from /img/<key>, fetching each one once.
+
+    - proxy_url(url) turns an image url into our /img/<key> url (urls on
+      hosts outside allowed_hosts are returned unchanged) and records the
+      key -> url ref on disk, so any worker can serve it
+    - the first request for a key fetches the image, following
+      redirects only to allowed hosts; its bytes are stored once under
+      their sha256 (blobs/ab/abcd...), shared by every url that has the
+      same content
+    - once the blobs pass max_bytes, the least recently served ones are
+      deleted until they're under 90% of it; refs to them refetch
+    - refs are never deleted, since pages already sent may still link
+      to their key: refs/ grows by one ~100 byte file per distinct
+      image url; clear it along with blobs/ if that ever matters
+    - hits are send_file responses, which gunicorn turns into sendfile(2)
+      (or X-Sendfile with USE_X_SENDFILE), with a year long immutable
+      Cache-Control
+
+    Configured from IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES and
+    IMAGE_ALLOWED_HOSTS (comma separated; subdomains are allowed too).
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=512 * 1024 * 1024,
+                 allowed_hosts=DEFAULT_ALLOWED_HOSTS, max_image_bytes=5 * 1024 * 1024,
+                 timeout=(3.05, 10), flight=single_flight, known_size=10000):
+        self.cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), "cookwhat-images")
+        self.max_bytes = max_bytes
+        self.allowed_hosts = tuple(allowed_hosts)
+        self.max_image_bytes = max_image_bytes
+        self.timeout = timeout
+        self.flight = flight
+        # keys whose ref we've written lately, so proxy_url skips the
+        # disk for them; older ones are simply checked on disk again
+        self._known = OrderedDict()
+        self.known_size = known_size
+        self._size = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def init_app(self, app):
+        self.cache_dir = app.config.get("IMAGE_CACHE_DIR") or self.cache_dir
+        self.max_bytes = int(app.config.get("IMAGE_CACHE_MAX_BYTES") or self.max_bytes)
+        hosts = app.config.get("IMAGE_ALLOWED_HOSTS")
+        if hosts:
+            self.allowed_hosts = tuple(h.strip() for h in hosts.split(",") if h.strip())
+        app.add_url_rule("/img/<key>", "image", self.view)
+        app.add_template_filter(self.proxy_url, "proxy_img")
+
+    ##################################################################
+    # urls
+
+    def is_allowed(self, url):
+        host = urlparse(url).hostname or ""
+        return any(host == h or host.endswith("." + h) for h in self.allowed_hosts)
+
+    def proxy_url(self, url):
+        """Return our /img/ url for an image url, or url itself if we won't proxy it."""
+        if not url or not isinstance(url, str) or not self.is_allowed(url):
+            return url
+        key = hashlib.sha1(url.encode()).hexdigest()
+        with self._lock:
+            known = key in self._known
+            if known:
+                self._known.move_to_end(key)
+        if not known:
+            path = self._ref_path(key)
+            if not os.path.exists(path):
+                self._write_json(path, {"url": url})
+            with self._lock:
+                self._known[key] = True
+                while len(self._known) > self.known_size:
+                    self._known.popitem(last=False)
+        return f"/img/{key}"
+
+    def proxy_image(self, item):
+        """Copy of an API dict (a recipe, say) with its "image" url proxied."""
+        if isinstance(item, dict) and item.get("image"):
+            return dict(item, image=self.proxy_url(item["image"]))
+        return item
+
+    ##################################################################
+    # serving
+
+    def view(self, key):
+        """Serve the image for key, fetching and storing it on first use."""
+        if len(key) != 40 or not all(c in "0123456789abcdef" for c in key):
+            abort(404)
+        ref = self._read_json(self._ref_path(key))
+        if ref is None:
+            abort(404)
+
+        if ref.get("blob"):
+            try:
+                return self._send(ref)
+            except OSError:
+                # evicted since (perhaps by another worker), fetch it again
+                pass
+        url = ref["url"]
+        try:
+            ref = self.flight.do(("image", key), lambda: self._fetch(key, url))
+        except (requests.RequestException, ValueError):
+            abort(502)
+        return self._send(ref)
+
+    def _send(self, ref):
+        path = self._blob_path(ref["blob"])
+        response = send_file(path, mimetype=ref["type"], conditional=True)
+        self._touch(path)
+        response.headers["Cache-Control"] = f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+        return response
+
+    def _fetch(self, key, url):
+        """Download url into the blob store and point key's ref at it."""
+        resp = self._get(url)
+        try:
+            resp.raise_for_status()
+            mimetype = resp.headers.get("Content-Type", "").split(";")[0].strip()
+            if not mimetype.startswith("image/"):
+                raise ValueError(f"{url} is not an image ({mimetype})")
+            data = bytearray()
+            for chunk in resp.iter_content(64 * 1024):
+                data += chunk
+                if len(data) > self.max_image_bytes:
+                    raise ValueError(f"{url} is larger than {self.max_image_bytes} bytes")
+        finally:
+            resp.close()
+
+        blob = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(blob)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+            self._grow(len(data))
+
+        ref = {"url": url, "blob": blob, "type": mimetype}
+        self._write_json(self._ref_path(key), ref)
+        return ref
+
+    def _get(self, url):
+        """GET url, following redirects only while they stay on allowed hosts."""
+        for _ in range(MAX_REDIRECTS + 1):
+            resp = self._session().get(url, timeout=self.timeout, stream=True,
+                                       allow_redirects=False)
+            if not resp.is_redirect:
+                return resp
+            resp.close()
+            url = urljoin(resp.url, resp.headers["Location"])
+            if not self.is_allowed(url):
+                raise ValueError(f"redirected to {url}, which isn't an allowed host")
+        raise ValueError(f"more than {MAX_REDIRECTS} redirects")
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    ##################################################################
+    # disk
+
+    def _ref_path(self, key):
+        return os.path.join(self.cache_dir, "refs", key[:2], key)
+
+    def _blob_path(self, blob):
+        return os.path.join(self.cache_dir, "blobs", blob[:2], blob)
+
+    def _read_json(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_json(self, path, value):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(value, f)
+        os.replace(tmp, path)
+
+    def _touch(self, path):
+        """Mark a blob as recently served, at most about once an hour."""
+        try:
+            if os.path.getmtime(path) < time.time() - 3600:
+                os.utime(path)
+        except OSError:
+            pass
+
+    def _grow(self, added):
+        """Count a new blob, evicting old ones if the store is now too big."""
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._blobs())
+            else:
+                self._size += added
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # other workers write blobs too, so measure the real size first
+        blobs = sorted(self._blobs())
+        self._size = sum(size for _, size, _ in blobs)
+        target = self.max_bytes * 0.9
+        for _, size, path in blobs:
+            if self._size <= target:
+                break
+            try:
+                os.remove(path)
+                self._size -= size
+            except OSError:
+                pass
+
+    def _blobs(self):
+        """(mtime, size, path) of every stored blob."""
+        root = os.path.join(self.cache_dir, "blobs")
+        for dirpath, _, filenames in os.walk(root):
+            for name in filenames:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+
+image_proxy = ImageProxy()
@@ -0,0 +1,219 @@
+# in-process search engine for the Ingredient catalog
+
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+from sqlalchemy import event
+from models import db, Ingredient
+
+# ranks, lower is better
+EXACT = 0
+NAME_PREFIX = 1
+WORD_PREFIX = 2
+FUZZY = 3
+
+# shortest word we'll try to correct, anything shorter matches too much
+MIN_FUZZY_LEN = 4
+
+
+def normalize(text):
+    """Lowercase text and collapse whitespace so 'Red  Onion' == 'red onion'."""
+    return " ".join(text.lower().split())
+
+
+def deletes(word):
+    """Return every variant of word with a single character removed.
+
+    Two words within one edit of each other (insert, delete, substitute or
+    swap neighbours) always share at least one of these variants.
+    """
+    return {word[:i] + word[i + 1:] for i in range(len(word))}
+
+
+class IngredientIndex:
+    """Prefix and typo tolerant search over (id, name) ingredient rows.
+
+    - terms: sorted list of (word, id) used for prefix lookups
+    - variants: single-delete variant -> words, used for typo lookups
+    - words: word -> ids of ingredients containing that word
+
+    Built lazily from the Ingredient table the first time it is searched,
+    then kept current by the model events below and a periodic diff
+    against the table for rows written by other processes.
+    """
+
+    def __init__(self, refresh_interval=300):
+        self.refresh_interval = refresh_interval
+        self._lock = threading.RLock()
+        self._names = {}
+        self._terms = []
+        self._words = defaultdict(set)
+        self._variants = defaultdict(set)
+        self._loaded_at = None
+
+    def __len__(self):
+        return len(self._names)
+
+    ##################################################################
+    # building
+
+    def load(self, rows):
+        """Replace the index contents with the given (id, name) rows."""
+        with self._lock:
+            self._names = {}
+            self._terms = []
+            self._words = defaultdict(set)
+            self._variants = defaultdict(set)
+            for id, name in rows:
+                self._add(id, name)
+            self._loaded_at = time.monotonic()
+
+    def refresh(self):
+        """Diff the index against the Ingredient table and apply the changes.
+
+        Only added, renamed or deleted rows are touched, so a refresh over
+        an unchanged catalog costs one query and a dict comparison.
+        """
+        rows = dict(db.session.query(Ingredient.id, Ingredient.name))
+        with self._lock:
+            for id in set(self._names) - set(rows):
+                self._remove(id)
+            for id, name in rows.items():
+                if self._names.get(id) != name:
+                    self._remove(id)
+                    self._add(id, name)
+            self._loaded_at = time.monotonic()
+
+    def add(self, id, name):
+        with self._lock:
+            self._remove(id)
+            self._add(id, name)
+
+    def remove(self, id):
+        with self._lock:
+            self._remove(id)
+
+    def _add(self, id, name):
+        self._names[id] = name
+        for word in set(normalize(name).split()):
+            insort(self._terms, (word, id))
+            if not self._words[word]:
+                for variant in deletes(word):
+                    self._variants[variant].add(word)
+            self._words[word].add(id)
+
+    def _remove(self, id):
+        name = self._names.pop(id, None)
+        if name is None:
+            return
+        for word in set(normalize(name).split()):
+            i = bisect_left(self._terms, (word, id))
+            if i < len(self._terms) and self._terms[i] == (word, id):
+                del self._terms[i]
+            self._words[word].discard(id)
+            if not self._words[word]:
+                del self._words[word]
+                for variant in deletes(word):
+                    self._variants[variant].discard(word)
+                    if not self._variants[variant]:
+                        del self._variants[variant]
+
+    def _ensure_fresh(self):
+        if self._loaded_at is None:
+            self.load(db.session.query(Ingredient.id, Ingredient.name))
+        elif time.monotonic() - self._loaded_at > self.refresh_interval:
+            self.refresh()
+
+    ##################################################################
+    # searching
+
+    def _prefix_ids(self, prefix):
+        """Return ids of ingredients with a word starting with prefix."""
+        ids = set()
+        i = bisect_left(self._terms, (prefix,))
+        while i < len(self._terms) and self._terms[i][0].startswith(prefix):
+            ids.add(self._terms[i][1])
+            i += 1
+        return ids
+
+    def _fuzzy_ids(self, word):
+        """Return ids of ingredients with a word about one edit from word."""
+        if len(word) < MIN_FUZZY_LEN:
+            return set()
+        ids = set()
+        for variant in deletes(word) | {word}:
+            for match in self._variants.get(variant, ()):
+                ids |= self._words[match]
+        for match in deletes(word):
+            ids |= self._words.get(match, set())
+        return ids
+
+    def _match_word(self, word, is_last):
+        """Return {id: rank} for a single query word.
+
+        The last word is still being typed so it is matched as a prefix,
+        earlier words must match a whole word (or be one typo away).
+        """
+        matches = {}
+        for id in self._fuzzy_ids(word):
+            matches[id] = FUZZY
+        if is_last:
+            exact = self._prefix_ids(word)
+        else:
+            exact = self._words.get(word, set())
+        for id in exact:
+            matches[id] = WORD_PREFIX
+        return matches
+
+    def search(self, query, number=10):
+        """Return up to number ingredients matching query, best first.
+
+        Results are dicts shaped like the Spoonacular ingredient search
+        results the front end already renders: {"id": ..., "name": ...}.
+        """
+        self._ensure_fresh()
+        query = normalize(query)
+        words = query.split()
+        if not words:
+            return []
+
+        with self._lock:
+            ranks = None
+            for i, word in enumerate(words):
+                matches = self._match_word(word, i == len(words) - 1)
+                if ranks is None:
+                    ranks = matches
+                else:
+                    ranks = {id: max(ranks[id], matches[id])
+                             for id in ranks.keys() & matches.keys()}
+                if not ranks:
+                    return []
+
+            scored = []
+            for id, rank in ranks.items():
+                name = self._names[id]
+                normalized = normalize(name)
+                if normalized == query:
+                    rank = EXACT
+                elif normalized.startswith(query):
+                    rank = NAME_PREFIX
+                scored.append((rank, len(name), normalized, id))
+
+        scored.sort()
+        return [{"id": id, "name": self._names[id]} for _, _, _, id in scored[:number]]
+
+
+ingredient_index = IngredientIndex()
+
+
+@event.listens_for(Ingredient, "after_insert")
+@event.listens_for(Ingredient, "after_update")
+def _index_ingredient(mapper, connection, target):
+    ingredient_index.add(target.id, target.name)
+
+
+@event.listens_for(Ingredient, "after_delete")
+def _unindex_ingredient(mapper, connection, target):
+    ingredient_index.remove(target.id)
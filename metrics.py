@@ -0,0 +1,261 @@
+# request, sql, template and upstream timings, exposed in Prometheus format
+
+import random
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from flask import Response, g, has_request_context, request, template_rendered, before_render_template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def _label_key(labels):
+    # values as strings, so series still sort when one label holds 200 and "error"
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Histogram:
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0, 0.0]
+            i = bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                series[0][i] += 1
+            series[1] += 1
+            series[2] += value
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, sum_) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_labels(key + (('le', bound),))} {cumulative}")
+                lines.append(f"{self.name}_bucket{_labels(key + (('le', '+Inf'),))} {total}")
+                lines.append(f"{self.name}_count{_labels(key)} {total}")
+                lines.append(f"{self.name}_sum{_labels(key)} {sum_:.6f}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._series = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        with self._lock:
+            self._series[_label_key(labels)] += amount
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._series.items()):
+                lines.append(f"{self.name}{_labels(key)} {value:g}")
+        return lines
+
+
+class Metrics:
+    """Collect timings for sampled requests and serve them at /metrics.
+
+    - per request latency by endpoint, method and status
+    - SQL statements per request and their time (SQLAlchemy engine events)
+    - template render time (Flask template signals)
+    - upstream API call latency by endpoint and status (api_client)
+    - response cache and single-flight counters, read at scrape time
+
+    METRICS_SAMPLE_RATE (0..1) is the fraction of requests timed; at 0
+    the hooks are never attached, so there is no per-request cost at all.
+    Sampled requests slower than SLOW_REQUEST_MS are logged with their
+    SQL and upstream breakdown. /metrics requires METRICS_TOKEN as a
+    bearer token; without one it is refused, except in debug and
+    testing where it is open.
+
+    Numbers are per process; each gunicorn worker keeps its own.
+    """
+
+    def __init__(self):
+        self.sample_rate = 1.0
+        self.slow_request_ms = 0
+        self.token = None
+        self.public = False
+        # name -> collector, so building the app twice doesn't repeat a family
+        self.extra_collectors = {}
+        self._listening = False
+
+        self.requests = Histogram(
+            "cookwhat_request_seconds", "Request latency by endpoint.")
+        self.sql = Histogram(
+            "cookwhat_sql_seconds", "SQL statement latency by endpoint.")
+        self.sql_per_request = Histogram(
+            "cookwhat_sql_statements_per_request", "SQL statements run per request.",
+            buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34))
+        self.templates = Histogram(
+            "cookwhat_template_render_seconds", "Jinja render time by template.")
+        self.upstream = Histogram(
+            "cookwhat_upstream_seconds", "Spoonacular call latency by endpoint and status.")
+        self.slow_requests = Counter(
+            "cookwhat_slow_requests_total", "Requests slower than SLOW_REQUEST_MS.")
+
+    def init_app(self, app):
+        self.sample_rate = float(app.config.get("METRICS_SAMPLE_RATE", self.sample_rate))
+        self.slow_request_ms = float(app.config.get("SLOW_REQUEST_MS", self.slow_request_ms))
+        self.token = app.config.get("METRICS_TOKEN")
+        self.public = not self.token and (app.debug or app.testing)
+        self.logger = app.logger
+
+        app.add_url_rule("/metrics", "metrics", self.view)
+
+        if self.sample_rate <= 0:
+            return
+
+        app.before_request(self._start_request)
+        app.after_request(self._end_request)
+        before_render_template.connect(self._start_template, app)
+        template_rendered.connect(self._end_template, app)
+        if not self._listening:
+            # on every Engine, once per process however many apps are built
+            event.listen(Engine, "before_cursor_execute", self._start_sql)
+            event.listen(Engine, "after_cursor_execute", self._end_sql)
+            self._listening = True
+
+    ##################################################################
+    # hooks
+
+    def _sample(self):
+        """Per request timings, or None if this request isn't sampled."""
+        if has_request_context():
+            return g.get("_metrics")
+        return None
+
+    def _start_request(self):
+        if self.sample_rate >= 1 or random.random() < self.sample_rate:
+            g._metrics = {"start": time.perf_counter(), "sql": 0, "sql_time": 0.0,
+                          "upstream": 0, "upstream_time": 0.0}
+
+    def _end_request(self, response):
+        sample = self._sample()
+        if sample is None:
+            return response
+        elapsed = time.perf_counter() - sample["start"]
+        endpoint = request.endpoint or "404"
+        self.requests.observe(elapsed, endpoint=endpoint, method=request.method,
+                              status=response.status_code)
+        self.sql_per_request.observe(sample["sql"], endpoint=endpoint)
+
+        if self.slow_request_ms and elapsed * 1000 >= self.slow_request_ms:
+            self.slow_requests.inc(endpoint=endpoint)
+            self.logger.warning(
+                "slow request %s %s %d %.0fms (sql %d in %.0fms, upstream %d in %.0fms)",
+                request.method, request.path, response.status_code, elapsed * 1000,
+                sample["sql"], sample["sql_time"] * 1000,
+                sample["upstream"], sample["upstream_time"] * 1000,
+            )
+        return response
+
+    def _start_sql(self, conn, cursor, statement, parameters, context, executemany):
+        if self._sample() is not None:
+            conn.info.setdefault("_metrics_start", []).append(time.perf_counter())
+
+    def _end_sql(self, conn, cursor, statement, parameters, context, executemany):
+        sample = self._sample()
+        if sample is None or not conn.info.get("_metrics_start"):
+            return
+        elapsed = time.perf_counter() - conn.info["_metrics_start"].pop()
+        sample["sql"] += 1
+        sample["sql_time"] += elapsed
+        self.sql.observe(elapsed, endpoint=request.endpoint or "404")
+
+    def _start_template(self, app, template, context):
+        sample = self._sample()
+        if sample is not None:
+            sample.setdefault("templates", []).append(time.perf_counter())
+
+    def _end_template(self, app, template, context):
+        sample = self._sample()
+        if sample is not None and sample.get("templates"):
+            elapsed = time.perf_counter() - sample["templates"].pop()
+            self.templates.observe(elapsed, template=template.name or "string")
+
+    def observe_upstream(self, path, status, elapsed):
+        """Record one upstream API call; called by api_client for every request."""
+        endpoint = re.sub(r"\d+", "{id}", path)
+        self.upstream.observe(elapsed, endpoint=endpoint, status=status)
+        sample = self._sample()
+        if sample is not None:
+            sample["upstream"] += 1
+            sample["upstream_time"] += elapsed
+
+    ##################################################################
+    # exposition
+
+    def register(self, name, collector):
+        """Add a function returning exposition lines for the metric family
+        name, called on each scrape. Registering a name again replaces it."""
+        self.extra_collectors[name] = collector
+
+    def register_stats(self, name, help, get_stats, label):
+        """Register a {key: {stat: n}} stats() method as a counter family."""
+        self.register(name, stats_collector(name, help, get_stats, label))
+
+    def expose(self):
+        lines = []
+        for metric in (self.requests, self.sql, self.sql_per_request, self.templates,
+                       self.upstream, self.slow_requests):
+            lines.extend(metric.expose())
+        for collector in self.extra_collectors.values():
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+    def view(self):
+        """Serve metrics in the Prometheus text format."""
+        if not self.public:
+            if not self.token:
+                return Response("set METRICS_TOKEN to scrape metrics\n", status=403,
+                                mimetype="text/plain")
+            if request.headers.get("Authorization") != f"Bearer {self.token}":
+                return Response("unauthorized\n", status=401, mimetype="text/plain")
+        return Response(self.expose(), mimetype="text/plain; version=0.0.4")
+
+
+def stats_collector(name, help, get_stats, label):
+    """Turn a {key: {stat: n}} stats() method into counter exposition lines."""
+
+    def collect():
+        lines = [f"# HELP {name} {help}", f"# TYPE {name} counter"]
+        for key, counts in sorted(get_stats().items()):
+            for stat, value in sorted(counts.items()):
+                lines.append(f"{name}{_labels(((label, key), ('stat', stat)))} {value}")
+        return lines
+
+    return collect
+
+
+metrics = Metrics()
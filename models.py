@@ -1,10 +1,11 @@
-# models for User, Fridge, Ingredients and method for db connection
+# models for User, Fridge, Ingredients, Recipes and method for db connection
 
-from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
+from datetime import datetime
+from db_routing import RoutingSQLAlchemy
+from passwords import password_hasher
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+# reads go to a replica when one is configured, see db_routing
+db = RoutingSQLAlchemy()
 
 
 class User(db.Model):
@@ -28,9 +29,11 @@ class User(db.Model):
         """Sign up user.
 
         Hashes password and adds user to system.
+
+        Raises HashingBusy if the password hashing pool is saturated.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode("UTF-8")
+        hashed_pwd = password_hasher.hash(password)
 
         user = User(
             username=username,
@@ -50,13 +53,20 @@ class User(db.Model):
         If user and pass match, returns that user object.
 
         If can't find matching user or if password is wrong, returns False.
+
+        If the stored hash was made with a different work factor than the
+        one configured now, it's replaced with a fresh hash (caller commits).
+
+        Raises HashingBusy if the password hashing pool is saturated.
         """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = password_hasher.check(user.password, password)
             if is_auth:
+                if password_hasher.needs_rehash(user.password):
+                    user.password = password_hasher.hash(password)
                 return user
 
         return False
@@ -80,8 +90,14 @@ class Fridge(db.Model):
     __tablename__ = "user_fridges"
 
     id = db.Column(db.Integer, primary_key=True)
+    # one fridge per user, and the index every fridge lookup goes through
     user_id = db.Column(
-        db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), nullable=False
+        db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), nullable=False, unique=True
+    )
+    # bumped whenever ingredients are added or removed, see fridge.bump_fridge_version
+    version = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    updated_at = db.Column(
+        db.DateTime, nullable=False, default=datetime.utcnow, server_default=db.func.now()
     )
 
     ingredients = db.relationship("Fridge_Ingredients")
@@ -91,9 +107,13 @@ class Fridge(db.Model):
 
     @classmethod
     def get_ingredients_list(cls, id):
-        """Get list of ingredients associated with fridge of given id"""
-        fridge = Fridge.query.get_or_404(id)
-        fridge_ingredients = [i.__dict__ for i in fridge.ingredients]
+        """Get list of (id, ing_id, name) rows for ingredients in fridge of given id"""
+        fridge_ingredients = (
+            db.session.query(Fridge_Ingredients.id, Fridge_Ingredients.ing_id, Fridge_Ingredients.name)
+            .filter(Fridge_Ingredients.fridge_id == id)
+            .order_by(Fridge_Ingredients.id)
+            .all()
+        )
         return fridge_ingredients
 
 
@@ -101,6 +121,10 @@ class Fridge_Ingredients(db.Model):
     """Relationship table between our fridge and ingredients. Our fridge!"""
 
     __tablename__ = "fridge_ingredients"
+    # an ingredient is only in a fridge once; also serves lookups by fridge
+    __table_args__ = (
+        db.Index("ix_fridge_ingredients_fridge_id_ing_id", "fridge_id", "ing_id", unique=True),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     fridge_id = db.Column(
@@ -113,6 +137,136 @@ class Fridge_Ingredients(db.Model):
         return f"<Ingredient #{self.ing_id}, stored in Fridge #{self.fridge_id}>"
 
 
+class Recipe(db.Model):
+    """Recipe information fetched from the API.
+
+    Recipes rarely change, so we keep them and only refetch once they are
+    older than the refresh age passed to get_fresh."""
+
+    __tablename__ = "recipes"
+
+    # same id the API uses for the recipe
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    title = db.Column(db.String, nullable=False)
+    image = db.Column(db.String)
+    info = db.Column(db.JSON, nullable=False)
+    fetched_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    steps = db.relationship(
+        "RecipeStep", order_by="RecipeStep.number", cascade="all, delete-orphan"
+    )
+
+    def __repr__(self):
+        return f"<Recipe #{self.id}, {self.title}>"
+
+    @property
+    def instructions(self):
+        """List of instruction step texts, in order."""
+        return [s.step for s in self.steps]
+
+    @classmethod
+    def get_fresh(cls, id, max_age):
+        """Get recipe of given id with its steps in one query.
+
+        Return None if we don't have it or it's older than max_age."""
+        recipe = cls.query.options(db.joinedload(cls.steps)).get(id)
+        if recipe and datetime.utcnow() - recipe.fetched_at <= max_age:
+            return recipe
+        return None
+
+    @classmethod
+    def store(cls, info, instructions):
+        """Add or refresh a recipe from API recipe info and analyzed instructions.
+
+        Steps from every instruction section are kept, in order.
+        """
+        recipe = cls.query.get(info["id"]) or Recipe(id=info["id"])
+        recipe.title = info.get("title", "")
+        recipe.image = info.get("image")
+        recipe.info = info
+        recipe.fetched_at = datetime.utcnow()
+
+        db.session.add(recipe)
+        if recipe.steps:
+            # old steps have to go before new ones can reuse their numbers
+            recipe.steps = []
+            db.session.flush()
+
+        steps = [s["step"] for section in instructions for s in section.get("steps", [])]
+        recipe.steps = [RecipeStep(number=n, step=step) for n, step in enumerate(steps, 1)]
+        return recipe
+
+
+class RecipeStep(db.Model):
+    """A single instruction step of a stored recipe."""
+
+    __tablename__ = "recipe_steps"
+    __table_args__ = (db.UniqueConstraint("recipe_id", "number"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    recipe_id = db.Column(
+        db.Integer, db.ForeignKey("recipes.id", ondelete="CASCADE"), nullable=False
+    )
+    number = db.Column(db.Integer, nullable=False)
+    step = db.Column(db.Text, nullable=False)
+
+    def __repr__(self):
+        return f"<Step {self.number} of Recipe #{self.recipe_id}>"
+
+
+class FridgeRecommendation(db.Model):
+    """Recipe search results last computed for a fridge.
+
+    Kept together with the ingredients query they were computed for, so
+    they're only served while the fridge still holds the same things.
+    (That column is "ingredients", "query" would shadow Model.query.)"""
+
+    __tablename__ = "fridge_recommendations"
+
+    fridge_id = db.Column(
+        db.Integer, db.ForeignKey("user_fridges.id", ondelete="CASCADE"), primary_key=True
+    )
+    ingredients = db.Column(db.Text, nullable=False)
+    results = db.Column(db.JSON, nullable=False)
+    computed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<FridgeRecommendation for Fridge #{self.fridge_id}>"
+
+    @classmethod
+    def get_current(cls, fridge_id, query, max_age):
+        """Return the row for fridge_id if it was computed for query no
+        longer than max_age ago, else None."""
+        rec = cls.query.get(fridge_id)
+        if rec and rec.ingredients == query and datetime.utcnow() - rec.computed_at <= max_age:
+            return rec
+        return None
+
+    @classmethod
+    def store(cls, fridge_id, query, results):
+        """Add or replace the results for fridge_id. Caller commits."""
+        rec = cls.query.get(fridge_id) or FridgeRecommendation(fridge_id=fridge_id)
+        rec.ingredients = query
+        rec.results = results
+        rec.computed_at = datetime.utcnow()
+        db.session.add(rec)
+        return rec
+
+
+class ServerSession(db.Model):
+    """Session data kept on our side, the cookie only holds the id."""
+
+    __tablename__ = "server_sessions"
+
+    id = db.Column(db.String(64), primary_key=True)
+    # zlib compressed, tagged JSON of the session dict
+    data = db.Column(db.LargeBinary, nullable=False)
+    expires = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<ServerSession expires {self.expires}>"
+
+
 def connect_db(app):
     """Connect this database to our Flask app."""
 
@@ -0,0 +1,97 @@
+# password hashing on a bounded pool, so bcrypt can't starve other routes
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+try:
+    from gevent.monkey import is_module_patched
+    from gevent.threadpool import ThreadPool
+except ImportError:  # only needed under gunicorn's gevent workers
+    is_module_patched = None
+
+DEFAULT_ROUNDS = 12
+
+
+class HashingBusy(Exception):
+    """Raised when too many hashes are already waiting for the pool."""
+
+
+class PasswordHasher:
+    """Hash and check bcrypt passwords on a small, bounded worker pool.
+
+    - rounds: bcrypt work factor (log2 of the cost) for new hashes
+    - max_workers: hashes running at once, i.e. cores spent on auth
+    - max_pending: hashes allowed to run or wait at once; past that new
+      requests wait up to wait_timeout seconds for a slot and then raise
+      HashingBusy rather than pile up behind a login burst
+
+    bcrypt releases the GIL while hashing, so the pool runs hashes in
+    parallel with the request threads instead of blocking them. Under
+    gevent the executor's "threads" would be greenlets, and a hash would
+    stall every request in the worker, so gevent's ThreadPool (real OS
+    threads) is used instead.
+    """
+
+    def __init__(self, rounds=DEFAULT_ROUNDS, max_workers=2, max_pending=16, wait_timeout=5):
+        self.rounds = rounds
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.wait_timeout = wait_timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Configure from BCRYPT_LOG_ROUNDS, BCRYPT_WORKERS and BCRYPT_MAX_PENDING."""
+        self.rounds = int(app.config.get("BCRYPT_LOG_ROUNDS", self.rounds))
+        self.max_workers = int(app.config.get("BCRYPT_WORKERS", self.max_workers))
+        self.max_pending = int(app.config.get("BCRYPT_MAX_PENDING", self.max_pending))
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(timeout=self.wait_timeout):
+            raise HashingBusy()
+        try:
+            if self._executor is None:
+                with self._lock:
+                    if self._executor is None:
+                        self._executor = self._make_executor()
+            if _under_gevent():
+                return self._executor.apply(func, args)
+            return self._executor.submit(func, *args).result()
+        finally:
+            self._slots.release()
+
+    def _make_executor(self):
+        if _under_gevent():
+            return ThreadPool(self.max_workers)
+        return ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="bcrypt")
+
+    def hash(self, password):
+        """Return the bcrypt hash of password at the configured work factor."""
+        salt = bcrypt.gensalt(rounds=self.rounds)
+        return self._run(bcrypt.hashpw, password.encode("UTF-8"), salt).decode("UTF-8")
+
+    def check(self, hashed, password):
+        """Return True if password matches the bcrypt hash."""
+        try:
+            return self._run(bcrypt.checkpw, password.encode("UTF-8"), hashed.encode("UTF-8"))
+        except ValueError:
+            # not a bcrypt hash at all, e.g. a plaintext seed password
+            return False
+
+    def needs_rehash(self, hashed):
+        """Return True if hashed was made with a different work factor."""
+        try:
+            return int(hashed.split("$")[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+
+def _under_gevent():
+    return is_module_patched is not None and is_module_patched("threading")
+
+
+password_hasher = PasswordHasher()
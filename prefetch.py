@@ -0,0 +1,149 @@
+# recipe details fetched in the background for search results we just sent
+
+import heapq
+import itertools
+import os
+import threading
+from collections import defaultdict
+
+
+class RecipePrefetcher:
+    """Bounded background pool that stores recipes before they're checked out.
+
+    - prefetch(ids) is given a page of search results, best first; the
+      first number of them are queued, ranked by position, so every
+      search's top result is fetched before anyone's second (newer
+      searches first within a rank)
+    - an id already waiting or being fetched isn't queued twice; asked
+      for again at a better rank, it moves up
+    - at most max_queue ids wait; when full, a new id pushes out the
+      lowest ranked waiting one, or is dropped if it ranks lower still
+    - max_workers threads run fetch(id) in an app context
+
+    fetch should return quickly when there's nothing to do (recipe
+    already stored, API struggling); a prefetch is only ever a head
+    start, check-out fetches whatever isn't there yet itself.
+
+    The pool is per process; each gunicorn worker runs its own.
+    """
+
+    def __init__(self, number=5, max_workers=2, max_queue=50):
+        self.number = number
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.enabled = True
+        self.app = None
+        self.fetch = None
+        # [rank, order, id, live]; entries pushed out or moved up are
+        # marked dead and skipped when popped
+        self._heap = []
+        self._queued = {}
+        self._running = set()
+        self._order = itertools.count(0, -1)
+        self._cond = threading.Condition()
+        self._stats = defaultdict(int)
+        self._pid = None
+
+    def init_app(self, app, fetch):
+        """Configure from PREFETCH_NUMBER, PREFETCH_WORKERS and PREFETCH_QUEUE.
+
+        fetch(id) fetches and stores one recipe."""
+        self.app = app
+        self.fetch = fetch
+        self.number = int(app.config.get("PREFETCH_NUMBER", self.number))
+        self.max_workers = int(app.config.get("PREFETCH_WORKERS", self.max_workers))
+        self.max_queue = int(app.config.get("PREFETCH_QUEUE", self.max_queue))
+
+    def prefetch(self, ids):
+        """Queue the first number of ids (best first) to be fetched."""
+        if not self.enabled or not self.number:
+            return
+        with self._cond:
+            self._start()
+            for rank, id in enumerate(ids[:self.number]):
+                self._push(rank, id)
+            self._cond.notify_all()
+
+    def pending(self):
+        """Number of recipes waiting for or in the middle of a fetch."""
+        with self._cond:
+            return len(self._queued) + len(self._running)
+
+    def stats(self):
+        """Return {"recipe": {"queued": n, "dropped": n, ...}}."""
+        with self._cond:
+            return {"recipe": dict(self._stats)}
+
+    def _push(self, rank, id):
+        if id in self._running:
+            self._stats["deduped"] += 1
+            return
+        entry = self._queued.get(id)
+        if entry is not None:
+            self._stats["deduped"] += 1
+            if entry[0] <= rank:
+                return
+            entry[3] = False
+            del self._queued[id]
+        elif len(self._queued) >= self.max_queue:
+            worst = max(self._queued.values())
+            if worst[0] <= rank:
+                self._stats["dropped"] += 1
+                return
+            worst[3] = False
+            del self._queued[worst[2]]
+            self._stats["dropped"] += 1
+        entry = [rank, next(self._order), id, True]
+        self._queued[id] = entry
+        heapq.heappush(self._heap, entry)
+        self._stats["queued"] += 1
+
+    ##################################################################
+    # worker threads
+
+    def _start(self):
+        """Start the worker threads, again after a fork."""
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._heap = []
+        self._queued = {}
+        self._running = set()
+        for n in range(self.max_workers):
+            threading.Thread(target=self._loop, name=f"prefetch-{n}", daemon=True).start()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                id = self._next()
+                self._running.add(id)
+            try:
+                self._run(id)
+            finally:
+                with self._cond:
+                    self._running.discard(id)
+
+    def _next(self):
+        """Wait for, and pop, the best ranked live entry."""
+        while True:
+            while not self._heap:
+                self._cond.wait()
+            rank, order, id, live = heapq.heappop(self._heap)
+            if live:
+                del self._queued[id]
+                return id
+
+    def _run(self, id):
+        try:
+            with self.app.app_context():
+                self.fetch(id)
+        except Exception:
+            self.app.logger.exception("prefetching recipe %s failed", id)
+            stat = "failed"
+        else:
+            stat = "done"
+        with self._cond:
+            self._stats[stat] += 1
+
+
+recipe_prefetcher = RecipePrefetcher()
@@ -0,0 +1,257 @@
+# in-process by-ingredient recipe search over the recipes we know about
+
+import json
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, Recipe
+
+# one immutable build of the index; searches use whichever is current
+Snapshot = namedtuple("Snapshot", "matrix columns sizes ids titles images likes")
+
+
+class RecipeMatcher:
+    """Score every known recipe against a fridge in one sparse pass.
+
+    - matrix: recipes x ingredients CSR incidence matrix; columns are the
+      Spoonacular ingredient ids stored in Fridge_Ingredients.ing_id
+    - match(ing_ids) multiplies it by the fridge's 0/1 ingredient vector,
+      giving every recipe's used count at once; missed is the recipe's
+      ingredient count minus used
+
+    Recipes come from a JSON lines corpus (RECIPE_CORPUS, one recipe in
+    Spoonacular's recipe information shape per line) and the Recipe
+    table. The table is read the first time the matcher is used, then
+    kept current by the model events below and a periodic read of rows
+    fetched since. Changes are batched: the search that notices them
+    starts a rebuild on a background thread, at most every rebuild_delay
+    seconds, and searches keep using the previous build until the new
+    one is swapped in. Only the very first build happens in a search.
+    """
+
+    def __init__(self, corpus_path=None, refresh_interval=300, rebuild_delay=1):
+        self.corpus_path = corpus_path
+        self.refresh_interval = refresh_interval
+        self.rebuild_delay = rebuild_delay
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        # recipe id -> (title, image, likes, ingredient ids)
+        self._recipes = {}
+        # ingredient id -> (name, image), for the used/missed lists
+        self._ingredients = {}
+        self._snapshot = None
+        self._dirty = False
+        self._rebuilding = False
+        # bumped by clear(), so a build started before it isn't swapped in
+        self._generation = 0
+        self._built_at = 0
+        self._loaded_at = None
+        self._fetched_since = None
+
+    def __len__(self):
+        return len(self._recipes)
+
+    def init_app(self, app):
+        self.corpus_path = app.config.get("RECIPE_CORPUS") or self.corpus_path
+
+    ##################################################################
+    # building
+
+    def add(self, info):
+        """Add or replace a recipe from API recipe information."""
+        ing_ids = []
+        for ing in info.get("extendedIngredients") or []:
+            id = ing.get("id")
+            if id is None or id in ing_ids:
+                continue
+            ing_ids.append(id)
+            self._ingredients.setdefault(id, (ing.get("name"), ing.get("image")))
+        with self._lock:
+            self._recipes[info["id"]] = (
+                info.get("title", ""), info.get("image"),
+                info.get("aggregateLikes", 0) or 0, tuple(ing_ids))
+            self._dirty = True
+
+    def remove(self, id):
+        with self._lock:
+            if self._recipes.pop(id, None) is not None:
+                self._dirty = True
+
+    def clear(self):
+        with self._lock:
+            self._recipes.clear()
+            self._ingredients.clear()
+            self._snapshot = None
+            self._dirty = False
+            self._generation += 1
+            self._loaded_at = None
+            self._fetched_since = None
+
+    def load_jsonl(self, path):
+        """Add every recipe in a JSON lines file; return how many there were."""
+        count = 0
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    self.add(json.loads(line))
+                    count += 1
+        return count
+
+    def refresh(self):
+        """Add recipes stored (or refetched) in the Recipe table since the last refresh."""
+        query = db.session.query(Recipe.fetched_at, Recipe.info)
+        if self._fetched_since is not None:
+            query = query.filter(Recipe.fetched_at > self._fetched_since)
+        newest = self._fetched_since
+        for fetched_at, info in query.yield_per(1000):
+            self.add(info)
+            newest = fetched_at if newest is None else max(newest, fetched_at)
+        self._fetched_since = newest
+        self._loaded_at = time.monotonic()
+
+    def load(self):
+        """Read the corpus and the Recipe table, then build the matrix."""
+        if self.corpus_path:
+            self.load_jsonl(self.corpus_path)
+        self.refresh()
+        self._rebuild()
+
+    def _ensure_fresh(self):
+        if self._loaded_at is None:
+            with self._load_lock:
+                if self._loaded_at is None:
+                    if self.corpus_path:
+                        self.load_jsonl(self.corpus_path)
+                    self._refresh_quietly()
+        elif time.monotonic() - self._loaded_at > self.refresh_interval:
+            self._refresh_quietly()
+        if self._dirty:
+            if self._snapshot is None:
+                self._rebuild()
+            else:
+                self._rebuild_later()
+
+    def _refresh_quietly(self):
+        try:
+            self.refresh()
+        except SQLAlchemyError:
+            # no table yet, or the database is down; try again next time
+            db.session.rollback()
+            self._loaded_at = time.monotonic()
+
+    def _rebuild_later(self):
+        with self._lock:
+            if self._rebuilding:
+                # the build under way will pick the changes up, or the next one will
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._rebuild_in_background, name="recipe-matcher",
+                         daemon=True).start()
+
+    def _rebuild_in_background(self):
+        try:
+            # let changes arriving close together share one build
+            time.sleep(max(0, self._built_at + self.rebuild_delay - time.monotonic()))
+            self._rebuild()
+        finally:
+            with self._lock:
+                self._rebuilding = False
+
+    def _rebuild(self):
+        with self._lock:
+            self._dirty = False
+            generation = self._generation
+            recipes = list(self._recipes.items())
+
+        sizes = np.fromiter((len(r[3]) for _, r in recipes), dtype=np.int64, count=len(recipes))
+        flat = np.fromiter((i for _, r in recipes for i in r[3]), dtype=np.int64,
+                           count=int(sizes.sum()))
+        columns = np.unique(flat)
+        indptr = np.zeros(len(recipes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=indptr[1:])
+        matrix = csr_matrix(
+            (np.ones(len(flat), dtype=np.float32), np.searchsorted(columns, flat), indptr),
+            shape=(len(recipes), len(columns)))
+
+        snapshot = Snapshot(
+            matrix=matrix,
+            columns=columns,
+            sizes=sizes,
+            ids=[id for id, _ in recipes],
+            titles=[r[0] for _, r in recipes],
+            images=[r[1] for _, r in recipes],
+            likes=np.fromiter((r[2] for _, r in recipes), dtype=np.int64, count=len(recipes)),
+        )
+        with self._lock:
+            if generation == self._generation:
+                self._snapshot = snapshot
+                self._built_at = time.monotonic()
+
+    ##################################################################
+    # searching
+
+    def match(self, ing_ids, number=10):
+        """Return up to number recipes using any of ing_ids, best first.
+
+        Most used ingredients first, then fewest missing, then most liked.
+        Results are shaped like the API's findByIngredients results, which
+        the front end already renders."""
+        self._ensure_fresh()
+        snap = self._snapshot
+        if snap is None or not snap.ids or not ing_ids:
+            return []
+
+        fridge = np.unique(np.fromiter(ing_ids, dtype=np.int64))
+        cols = np.searchsorted(snap.columns, fridge)
+        known = cols < len(snap.columns)
+        cols = cols[known][snap.columns[cols[known]] == fridge[known]]
+        if not cols.size:
+            return []
+        have = np.zeros(len(snap.columns), dtype=np.float32)
+        have[cols] = 1
+
+        used = (snap.matrix @ have).astype(np.int64)
+        candidates = np.flatnonzero(used)
+        missed = snap.sizes[candidates] - used[candidates]
+        # lexsort sorts by the last key first
+        order = np.lexsort((-snap.likes[candidates], missed, -used[candidates]))
+        return [self._result(snap, row, have) for row in candidates[order[:number]]]
+
+    def _result(self, snap, row, have):
+        start, end = snap.matrix.indptr[row], snap.matrix.indptr[row + 1]
+        cols = snap.matrix.indices[start:end]
+        used, missed = [], []
+        for col in cols:
+            id = int(snap.columns[col])
+            name, image = self._ingredients.get(id, (None, None))
+            (used if have[col] else missed).append({"id": id, "name": name, "image": image})
+        return {
+            "id": snap.ids[row],
+            "title": snap.titles[row],
+            "image": snap.images[row],
+            "likes": int(snap.likes[row]),
+            "usedIngredientCount": len(used),
+            "missedIngredientCount": len(missed),
+            "usedIngredients": used,
+            "missedIngredients": missed,
+        }
+
+
+recipe_matcher = RecipeMatcher()
+
+
+@event.listens_for(Recipe, "after_insert")
+@event.listens_for(Recipe, "after_update")
+def _match_recipe(mapper, connection, target):
+    recipe_matcher.add(target.info)
+
+
+@event.listens_for(Recipe, "after_delete")
+def _unmatch_recipe(mapper, connection, target):
+    recipe_matcher.remove(target.id)
@@ -0,0 +1,183 @@
+# recipe recommendations per fridge, recomputed in the background when it changes
+
+import heapq
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import requests
+from sqlalchemy.exc import IntegrityError
+
+from api_cache import is_error_response
+from fridge import ingredients_query
+from models import db, Fridge, FridgeRecommendation
+
+
+class RecommendationQueue:
+    """Debounced background jobs that keep FridgeRecommendation rows current.
+
+    - schedule(fridge_id) is called after a fridge changes; the job runs
+      debounce seconds after the last change, so a burst of adds and
+      removes costs one recipe search
+    - jobs run on max_workers threads, a fridge is never refreshed twice
+      at once
+    - number is how many recipes are stored per fridge
+    - after a failed search (API down or rate limited) no job runs for
+      retry_delay seconds, doubling with each failure in a row up to
+      max_retry_delay, rather than asking again on every page load
+
+    Results are stored with the ingredients query they answer, and
+    current() only returns them while that still matches the fridge,
+    so a lost or late job means a live search, never wrong recipes.
+
+    The queue is per process; each gunicorn worker runs its own.
+    """
+
+    def __init__(self, debounce=2.0, max_workers=2, number=10, max_age=timedelta(days=1),
+                 retry_delay=30, max_retry_delay=600):
+        self.debounce = debounce
+        self.max_workers = max_workers
+        self.number = number
+        self.max_age = max_age
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._failures = 0
+        self._retry_at = 0
+        self.enabled = True
+        self.app = None
+        self.search = None
+        self._due = {}
+        self._heap = []
+        self._running = set()
+        self._cond = threading.Condition()
+        self._pid = None
+        self._executor = None
+
+    def init_app(self, app, search):
+        """Configure from RECOMMEND_DEBOUNCE, RECOMMEND_WORKERS and RECOMMEND_NUMBER.
+
+        search(query, ingredients, number) is the recipe search whose
+        results are stored; ingredients are the fridge's (id, ing_id, name)
+        rows. It returns None or an error response when it failed."""
+        self.app = app
+        self.search = search
+        self.debounce = float(app.config.get("RECOMMEND_DEBOUNCE", self.debounce))
+        self.max_workers = int(app.config.get("RECOMMEND_WORKERS", self.max_workers))
+        self.number = int(app.config.get("RECOMMEND_NUMBER", self.number))
+
+    def current(self, fridge_id, query):
+        """The fridge's FridgeRecommendation if it matches query, else None."""
+        return FridgeRecommendation.get_current(fridge_id, query, self.max_age)
+
+    def schedule(self, fridge_id):
+        """Recompute the fridge's recipes once it has been quiet for debounce seconds."""
+        if not self.enabled:
+            return
+        with self._cond:
+            self._start()
+            due = max(time.monotonic() + self.debounce, self._retry_at)
+            self._due[fridge_id] = due
+            heapq.heappush(self._heap, (due, fridge_id))
+            self._cond.notify()
+
+    def pending(self):
+        """Number of fridges waiting for or in the middle of a refresh."""
+        with self._cond:
+            return len(self._due) + len(self._running)
+
+    def refresh(self, fridge_id):
+        """Search recipes for the fridge's current contents and store them.
+
+        Needs an app context. Return the stored results, or None if the
+        search failed (the old row is left alone)."""
+        ingredients = Fridge.get_ingredients_list(fridge_id)
+        query = ingredients_query(ingredients)
+        if query:
+            try:
+                results = self.search(query, ingredients, self.number)
+            except requests.RequestException:
+                results = None
+            if results is None or is_error_response(results):
+                self._failed()
+                return None
+        else:
+            results = []
+        with self._cond:
+            self._failures = 0
+
+        FridgeRecommendation.store(fridge_id, query, results)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # the fridge was deleted, or another worker stored it first
+            db.session.rollback()
+        return results
+
+    def _failed(self):
+        """Hold off the next jobs, longer with each failure in a row."""
+        with self._cond:
+            self._failures += 1
+            delay = min(self.retry_delay * 2 ** (self._failures - 1), self.max_retry_delay)
+            self._retry_at = time.monotonic() + delay
+
+    ##################################################################
+    # background thread
+
+    def _start(self):
+        """Start the scheduler thread and pool, again after a fork."""
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._due.clear()
+        self._heap = []
+        self._running = set()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="recommend")
+        threading.Thread(target=self._loop, name="recommend-scheduler", daemon=True).start()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                fridge_id = self._next_due()
+                self._running.add(fridge_id)
+            self._executor.submit(self._run, fridge_id)
+
+    def _next_due(self):
+        """Wait for, and pop, the next fridge whose debounce has passed."""
+        while True:
+            if not self._heap:
+                self._cond.wait()
+                continue
+            due, fridge_id = self._heap[0]
+            if self._due.get(fridge_id) != due:
+                # rescheduled since, a later heap entry stands for it
+                heapq.heappop(self._heap)
+                continue
+            wait = due - time.monotonic()
+            if wait > 0:
+                self._cond.wait(wait)
+                continue
+            heapq.heappop(self._heap)
+            if fridge_id in self._running:
+                # still refreshing from an earlier change, go again after it
+                retry = time.monotonic() + max(self.debounce, 0.1)
+                self._due[fridge_id] = retry
+                heapq.heappush(self._heap, (retry, fridge_id))
+                continue
+            del self._due[fridge_id]
+            return fridge_id
+
+    def _run(self, fridge_id):
+        try:
+            with self.app.app_context():
+                self.refresh(fridge_id)
+        except Exception:
+            self.app.logger.exception("refreshing recommendations for fridge %s failed", fridge_id)
+        finally:
+            with self._cond:
+                self._running.discard(fridge_id)
+
+
+recommendation_queue = RecommendationQueue()
@@ -1,16 +1,201 @@
-"""Seed database with sample data from CSV Files."""
+"""Seed database with sample data from CSV Files.
 
-from csv import DictReader
-from app import db
-from models import Ingredient, User, Fridge
+Streams each CSV in chunks and upserts it, so it can be re-run safely and
+can load files far larger than memory:
 
-db.drop_all()
-db.create_all()
+- Postgres: each chunk is COPYed into a temp table, then merged into the
+  real table with INSERT ... ON CONFLICT DO UPDATE
+- anything else (e.g. sqlite): batched INSERT ... ON CONFLICT DO UPDATE
 
-with open('generator/ingredients.csv') as ingredients:
-    db.session.bulk_insert_mappings(Ingredient, DictReader(ingredients))
+Rows are matched on their key columns (TABLES below), not on id. Files
+with explicit ids (generator/generate.py's) have to go into a database
+where those ids are free or already theirs: a row whose id belongs to a
+different row (say users seeded from generator/users.csv first) stops
+the load with an error rather than clobbering it. Load them into an
+empty database.
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
+User passwords in users.csv are plaintext; they're bcrypt hashed on a
+process pool before loading, so seeded users can actually log in.
 
-db.session.commit()
+    python seed.py                          # the files in generator/
+    python seed.py --users big_users.csv --chunk-size 50000 --rounds 4
+
+generator/generate.py writes larger synthetic users, fridges and
+fridge_ingredients files for --users, --fridges and --fridge-ingredients.
+"""
+
+import argparse
+import csv
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import bcrypt
+
+from app import create_app
+from models import db
+
+# table -> (columns that identify a row, optional columns besides the key)
+TABLES = {
+    "ingredients": (("id",), ("name",)),
+    "users": (("username",), ("id", "email", "password", "avatar_img", "bio")),
+    "user_fridges": (("user_id",), ("id",)),
+    "fridge_ingredients": (("fridge_id", "ing_id"), ("id", "name")),
+}
+
+# table -> (command line option, default file)
+FILES = {
+    "ingredients": ("--ingredients", "generator/ingredients.csv"),
+    "users": ("--users", "generator/users.csv"),
+    "user_fridges": ("--fridges", ""),
+    "fridge_ingredients": ("--fridge-ingredients", ""),
+}
+
+
+def hash_password(password, rounds):
+    return bcrypt.hashpw(password.encode("UTF-8"), bcrypt.gensalt(rounds)).decode("UTF-8")
+
+
+def hash_passwords(pool, passwords, rounds):
+    return list(pool.map(hash_password, passwords, [rounds] * len(passwords), chunksize=32))
+
+
+def read_header(path):
+    """Return the CSV's column names, [] for an empty file."""
+    with open(path, newline="") as f:
+        return next(csv.reader(f), [])
+
+
+def read_chunks(path, chunk_size):
+    """Yield lists of up to chunk_size CSV rows, after the header."""
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        while True:
+            rows = list(islice(reader, chunk_size))
+            if not rows:
+                return
+            yield rows
+
+
+def upsert_sql(table, columns, keys, source):
+    """INSERT ... ON CONFLICT DO UPDATE from source (a VALUES list or SELECT)."""
+    updates = [c for c in columns if c not in keys and c != "id"]
+    conflict = f"ON CONFLICT ({', '.join(keys)}) "
+    if updates:
+        conflict += "DO UPDATE SET " + ", ".join(f"{c} = excluded.{c}" for c in updates)
+    else:
+        conflict += "DO NOTHING"
+    return f"INSERT INTO {table} ({', '.join(columns)}) {source} {conflict}"
+
+
+class Loader:
+    def __init__(self, chunk_size, rounds, pool):
+        self.chunk_size = chunk_size
+        self.rounds = rounds
+        self.pool = pool
+        self.use_copy = db.engine.dialect.name == "postgresql"
+
+    def load(self, table, path):
+        keys, optional = TABLES[table]
+        columns = read_header(path)
+        unknown = set(columns) - set(keys) - set(optional)
+        if unknown:
+            raise ValueError(f"{path}: unexpected columns {sorted(unknown)}")
+        total = 0
+        check_ids = "id" in columns and keys != ("id",)
+        for rows in read_chunks(path, self.chunk_size):
+            if check_ids:
+                self._check_ids(path, table, columns, keys, rows)
+            if "password" in columns:
+                i = columns.index("password")
+                hashed = hash_passwords(self.pool, [r[i] for r in rows], self.rounds)
+                for row, password in zip(rows, hashed):
+                    row[i] = password
+            if self.use_copy:
+                self._copy_chunk(table, columns, keys, rows)
+            else:
+                self._insert_chunk(table, columns, keys, rows)
+            total += len(rows)
+            print(f"{table}: {total} rows")
+        if total and "id" in columns and self.use_copy:
+            self._sync_sequence(table)
+        return total
+
+    def _check_ids(self, path, table, columns, keys, rows):
+        """Raise ValueError if an explicit id in rows is taken by a row with another key."""
+        id_at = columns.index("id")
+        key_at = [columns.index(k) for k in keys]
+        wanted = {int(row[id_at]): tuple(row[i] for i in key_at) for row in rows}
+        query = db.text(f"SELECT id, {', '.join(keys)} FROM {table} WHERE id IN :ids")
+        query = query.bindparams(db.bindparam("ids", expanding=True))
+        with db.engine.connect() as conn:
+            for id, *key in conn.execute(query, ids=list(wanted)):
+                if tuple(str(v) for v in key) != wanted[id]:
+                    raise ValueError(
+                        f"{path}: id {id} is already {table} row {tuple(key)}; "
+                        f"load files with explicit ids into an empty database")
+
+    def _insert_chunk(self, table, columns, keys, rows):
+        values = "VALUES (" + ", ".join(f":{c}" for c in columns) + ")"
+        params = [{c: (v if v != "" else None) for c, v in zip(columns, row)} for row in rows]
+        with db.engine.begin() as conn:
+            conn.execute(db.text(upsert_sql(table, columns, keys, values)), params)
+
+    def _copy_chunk(self, table, columns, keys, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+
+        conn = db.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            staging = f"seed_{table}"
+            cursor.execute(
+                f"CREATE TEMP TABLE IF NOT EXISTS {staging} "
+                f"(LIKE {table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS")
+            cursor.copy_expert(
+                f"COPY {staging} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+            cursor.execute(upsert_sql(
+                table, columns, keys, f"SELECT {', '.join(columns)} FROM {staging}"))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _sync_sequence(self, table):
+        """Move the id sequence past ids we loaded explicitly."""
+        with db.engine.begin() as conn:
+            conn.execute(db.text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f"COALESCE((SELECT MAX(id) FROM {table}), 1))"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    for table, (option, path) in FILES.items():
+        parser.add_argument(option, dest=table, default=path, help=f"CSV for {table} ('' to skip)")
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--rounds", type=int,
+                        default=int(os.environ.get("BCRYPT_LOG_ROUNDS", 12)),
+                        help="bcrypt work factor for seeded passwords")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="processes used to hash passwords")
+    args = parser.parse_args()
+
+    # spawn, not fork: forked children would share our open db connections
+    context = multiprocessing.get_context("spawn")
+    app = create_app({"WARM_UP": False})
+    with app.app_context():
+        db.create_all()
+        with ProcessPoolExecutor(max_workers=args.workers, mp_context=context) as pool:
+            loader = Loader(args.chunk_size, args.rounds, pool)
+            for table in TABLES:
+                path = getattr(args, table)
+                if path:
+                    loader.load(table, path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# server side sessions: the cookie carries a random id, the data lives in our db
+
+import random
+import secrets
+import zlib
+from datetime import datetime
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+from models import db, ServerSession
+
+# roughly one save in this many also clears out expired sessions
+PURGE_EVERY = 1000
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session dict that remembers its id and whether it was changed."""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        # the id given up by regenerate(), its row is deleted on save
+        self.old_sid = None
+
+    def regenerate(self):
+        """Move the session to a fresh id, e.g. at login and logout, so an
+        id planted in the browser beforehand is worth nothing after."""
+        if not self.new and self.old_sid is None:
+            self.old_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.modified = True
+
+
+class DbSessionInterface(SessionInterface):
+    """Keep session data in the server_sessions table.
+
+    The cookie only holds an unguessable session id, so it stays a few
+    dozen bytes no matter what we put in the session, and there's no
+    signing or parsing of session blobs on each request. Data is stored
+    zlib compressed and only written back when the session changed.
+
+    Reads and writes go through their own connection rather than
+    db.session, so saving the session never commits (or rolls back)
+    whatever the view left in the ORM session.
+
+    Every request that sends a session cookie costs one primary key
+    lookup here, on the primary; that's the price of revocable,
+    cookie-size-independent sessions. (The user row itself still comes
+    from user_cache.)
+    """
+
+    serializer = TaggedJSONSerializer()
+    session_class = ServerSideSession
+
+    def _table(self):
+        return ServerSession.__table__
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(app.session_cookie_name)
+        if not sid:
+            return self.session_class(sid=secrets.token_urlsafe(32), new=True)
+
+        table = self._table()
+        with db.engine.connect() as conn:
+            row = conn.execute(
+                table.select().where(table.c.id == sid)
+            ).first()
+        if row is None or row.expires <= datetime.utcnow():
+            return self.session_class(sid=secrets.token_urlsafe(32), new=True)
+
+        data = self.serializer.loads(zlib.decompress(row.data).decode("UTF-8"))
+        return self.session_class(data, sid=sid)
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        table = self._table()
+
+        if session.old_sid is not None:
+            with db.engine.begin() as conn:
+                conn.execute(table.delete().where(table.c.id == session.old_sid))
+            session.old_sid = None
+
+        if not session:
+            if session.modified:
+                with db.engine.begin() as conn:
+                    conn.execute(table.delete().where(table.c.id == session.sid))
+                response.delete_cookie(app.session_cookie_name, domain=domain, path=path)
+            return
+
+        if not self.should_set_cookie(app, session):
+            return
+
+        expires = self.get_expiration_time(app, session)
+        stored_until = expires or datetime.utcnow() + app.permanent_session_lifetime
+        data = zlib.compress(self.serializer.dumps(dict(session)).encode("UTF-8"))
+
+        with db.engine.begin() as conn:
+            updated = conn.execute(
+                table.update().where(table.c.id == session.sid),
+                data=data, expires=stored_until,
+            ).rowcount
+            if not updated:
+                conn.execute(table.insert(), id=session.sid, data=data, expires=stored_until)
+            if random.randrange(PURGE_EVERY) == 0:
+                conn.execute(table.delete().where(table.c.expires <= datetime.utcnow()))
+
+        response.set_cookie(
+            app.session_cookie_name,
+            session.sid,
+            expires=expires,
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
@@ -0,0 +1,183 @@
+# collapse identical, concurrent API calls into a single upstream fetch
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on windows
+    fcntl = None
+
+
+class _Call:
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """Make concurrent callers asking for the same key share one fetch.
+
+    The first caller for a key (the leader) runs the fetch, everyone who
+    arrives while it is in flight waits for and receives the leader's
+    result, or its exception.
+
+    Within a process this is coordinated with threads. When lock_dir is
+    set (SINGLE_FLIGHT_LOCK_DIR), leaders also take an exclusive file
+    lock for the key and leave their (JSON) result next to it for
+    share_ttl seconds, so leaders in other gunicorn workers on the same
+    host queue behind the first one and reuse its result instead of
+    fetching in parallel. Results the caller's share() rejects (error
+    responses, say) aren't left for others. Every purge_interval seconds
+    a leader deletes result and lock files nobody has used lately.
+    """
+
+    def __init__(self, lock_dir=None, lock_timeout=10, share_ttl=5, purge_interval=300):
+        self.lock_dir = lock_dir if fcntl else None
+        self.lock_timeout = lock_timeout
+        self.share_ttl = share_ttl
+        self.purge_interval = purge_interval
+        self._next_purge = 0
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = defaultdict(lambda: defaultdict(int))
+
+    def init_app(self, app):
+        """Configure from SINGLE_FLIGHT_LOCK_DIR; unset coordinates threads only."""
+        lock_dir = app.config.get("SINGLE_FLIGHT_LOCK_DIR")
+        if lock_dir and fcntl:
+            os.makedirs(lock_dir, exist_ok=True)
+        self.lock_dir = lock_dir if fcntl else None
+
+    def do(self, key, fetch, share=None):
+        """Return fetch() for key, running it at most once at a time.
+
+        share(value) says whether other workers may reuse the value; by
+        default they may."""
+        endpoint = key[0] if isinstance(key, tuple) else key
+
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self._stats[endpoint]["collapsed"] += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self._stats[endpoint]["leaders"] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = self._fetch_across_workers(key, endpoint, fetch, share)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.value
+
+    def _fetch_across_workers(self, key, endpoint, fetch, share):
+        if self.lock_dir is None:
+            return fetch()
+        self._purge_now_and_then()
+
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        path = os.path.join(self.lock_dir, digest)
+        with open(f"{path}.lock", "a") as lock_file:
+            if not self._acquire(lock_file):
+                # someone is holding it far too long, don't wait forever
+                return fetch()
+            try:
+                # marks the lock as in use, for _purge
+                os.utime(f"{path}.lock")
+                try:
+                    if time.time() - os.path.getmtime(f"{path}.json") < self.share_ttl:
+                        with open(f"{path}.json") as shared:
+                            value = json.load(shared)
+                        with self._lock:
+                            self._stats[endpoint]["collapsed_across_workers"] += 1
+                        return value
+                except (OSError, ValueError):
+                    pass
+
+                value = fetch()
+                if share is not None and not share(value):
+                    return value
+                try:
+                    with open(f"{path}.tmp", "w") as shared:
+                        json.dump(value, shared)
+                    os.replace(f"{path}.tmp", f"{path}.json")
+                except (OSError, TypeError, ValueError):
+                    pass
+                return value
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _purge_now_and_then(self):
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_purge:
+                return
+            self._next_purge = now + self.purge_interval
+        self._purge()
+
+    def _purge(self):
+        """Delete results past share_ttl and locks untouched for a while.
+
+        A worker that opened a lock just as it's deleted locks a file of
+        its own; the worst that does is one extra fetch."""
+        now = time.time()
+        idle = max(self.share_ttl, self.lock_timeout) * 2
+        try:
+            names = os.listdir(self.lock_dir)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.lock_dir, name)
+            max_age = self.share_ttl if name.endswith(".json") else idle
+            try:
+                if now - os.path.getmtime(path) > max_age:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _acquire(self, lock_file):
+        """Take an exclusive lock on lock_file, waiting up to lock_timeout."""
+        waited = 0.0
+        delay = 0.01
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                if waited >= self.lock_timeout:
+                    return False
+                time.sleep(delay)
+                waited += delay
+                delay = min(delay * 2, 0.2)
+
+    def stats(self):
+        """Return {endpoint: {"leaders": n, "collapsed": n, ...}}."""
+        with self._lock:
+            return {endpoint: dict(counts) for endpoint, counts in self._stats.items()}
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+
+single_flight = SingleFlight()
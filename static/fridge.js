@@ -6,8 +6,10 @@ $('.delete-ing').click(deleteIng)
 
 async function deleteIng() {
     const id = $(this).parent().data('id')
-    await axios.delete(`/fridge/ingredient/remove/${id}`)
-    $(this).parent().remove()
+    let res = await axios.post('/fridge/ingredients/remove', { ids: [id] })
+    for (let removedId of res.data.removed) {
+        $(`#currentFridge li[data-id="${removedId}"]`).remove()
+    }
 }
 
 $('#fridgeModalButton').click(showFridgeModal)
@@ -35,6 +37,11 @@ async function requestIngredients() {
     const query = $('#query').val()
     const number = $('#quantity').val()
     let ings = await axios.get(`/ingredient/search/${query}&${number}`)
+    if (ings.headers['x-cookwhat-degraded']) {
+        $('#ingResultsForm').append(
+            '<p class="text-warning">Ingredient search is unavailable right now, please try again later.</p>'
+        )
+    }
 
     for (let ingsData of ings.data) {
         let ing = $(generateIngResultHTML(ingsData));
@@ -48,26 +55,25 @@ async function requestIngredients() {
 
 
 function generateIngResultHTML(ing) {
-    return `<div><input type="radio" class="form-check-input" name="ingredient" id="${ing.id}" value="${ing.name}">
+    return `<div><input type="checkbox" class="form-check-input" name="ingredient" id="${ing.id}" value="${ing.name}">
     <label class="form-check-label" for="${ing.id}">${ing.name}</label></div>`
 }
 
 async function addToFridge() {
-    let ing_name = $(":radio:checked").val();
-    let ing_id = $(":radio:checked").attr('id');
+    let ingredients = $('#ingResultsForm :checkbox:checked').map(function () {
+        return { ing_id: $(this).attr('id'), ing_name: $(this).val() }
+    }).get();
 
-    // add ingredient to database
-    await axios.post('/fridge/ingredient/add', json = { ing_name, ing_id });
-
-    // Obtain ing id from fridge it's container within - we need this later
-    // to delete from the database, using our current setup.
-    let res_ing = await axios.get(`/fridge/ingredient/search/${ing_id}`);
-    let ing_f_id = res_ing.data
+    // add all checked ingredients to database in one go, the response
+    // carries the ids within the fridge we need later to delete them
+    let res = await axios.post('/fridge/ingredients/add', { ingredients });
 
     // generate the HTML and add to page
-    let ing = $(generateNewFridgeItemHTML(ing_name, ing_f_id));
-    $('#currentFridge').append(ing);
-    $(`#dlt-btn-${ing_f_id}`).click(deleteIng)
+    for (let added of res.data.added) {
+        let ing = $(generateNewFridgeItemHTML(added.name, added.id));
+        $('#currentFridge').append(ing);
+        $(`#dlt-btn-${added.id}`).click(deleteIng)
+    }
 
     hideFridgeModal();
 }
@@ -85,13 +91,41 @@ async function requestRcps() {
         $('#recipeResults').empty()
     }
 
-    let res = await axios.get('/recipe/search')
-    let rcps = res.data
-    console.log(rcps)
+    // results come back one recipe per line, so show each card as soon
+    // as its line arrives instead of waiting for the whole list
+    let res = await fetch('/recipe/search?stream=1', { credentials: 'same-origin' })
+    if (res.headers.get('X-Cookwhat-Degraded')) {
+        // the recipe API can't be reached, these come from our own store
+        $('#recipeResults').append(
+            '<p class="text-warning">Recipe search is having trouble, showing recipes we already have.</p>'
+        )
+    }
+    let reader = res.body.getReader()
+    let decoder = new TextDecoder()
+    let buffered = ''
+
+    while (true) {
+        let { done, value } = await reader.read()
+        if (done) break
+        buffered += decoder.decode(value, { stream: true })
+        let lines = buffered.split('\n')
+        // the last piece may be half a line, keep it for the next chunk
+        buffered = lines.pop()
+        lines.forEach(appendRecipeLine)
+    }
+    appendRecipeLine(buffered)
+}
 
-    for (let rcp of rcps) {
-        let rcp_cd = $(generateRecipeListHTML(rcp));
-        $('#recipeResults').append(rcp_cd);
+function appendRecipeLine(line) {
+    if (!line.trim()) return
+    let rcp = JSON.parse(line)
+    if (typeof rcp === 'string') {
+        // not logged in, the server answers with a plain message
+        console.log(rcp)
+    } else if (rcp.error) {
+        $('#recipeResults').append(`<p class="text-danger">${rcp.error}</p>`)
+    } else {
+        $('#recipeResults').append($(generateRecipeListHTML(rcp)))
     }
 }
 
@@ -1,16 +1,69 @@
-from app import app, CURR_USER_KEY
+from app import create_app, CURR_USER_KEY, fridge_fragments, spoonacular
+import gzip
+import json
 import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from unittest import TestCase
+from unittest.mock import patch
+from urllib.parse import urlencode
 
-from models import db, connect_db, User, Ingredient, Fridge, Fridge_Ingredients
+from models import db, connect_db, User, Ingredient, Fridge, Fridge_Ingredients, Recipe, RecipeStep, ServerSession, FridgeRecommendation
+from ingredient_search import IngredientIndex
+from api_cache import ResponseCache, api_cache, cached, make_key
+from single_flight import SingleFlight
+from user_cache import user_cache
+from metrics import metrics
+from passwords import PasswordHasher, HashingBusy, password_hasher
+from recommendations import RecommendationQueue, recommendation_queue
+from prefetch import RecipePrefetcher, recipe_prefetcher
+from image_proxy import ImageProxy, image_proxy
+from recipe_matcher import RecipeMatcher, recipe_matcher
+from api_client import UpstreamClient
+from upstream_guard import upstream_guard, mark_degraded, is_degraded, UpstreamGuard, RateLimiter, CircuitBreaker, UpstreamUnavailable, DEGRADED_HEADER
+import fake_spoonacular
+import requests
+import seed
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
+from flask_sqlalchemy import get_state
+from db_routing import PIN_COOKIE
 
-os.environ['DATABASE_URL'] = "postgresql:///cookwhat-test"
+# a throwaway SQLite file unless TEST_DATABASE_URL says otherwise
+TEST_DATABASE_URL = os.environ.get(
+    "TEST_DATABASE_URL", "sqlite:///" + os.path.join(tempfile.gettempdir(), "cookwhat-test.db"))
 
-db.create_all()
+TEST_CONFIG = {
+    "SQLALCHEMY_DATABASE_URI": TEST_DATABASE_URL,
+    "SQLALCHEMY_ECHO": False,
+    "SECRET_KEY": "test",
+    "API_KEY": "test",
+    "DEBUG_TB_ENABLED": False,
+    "WTF_CSRF_ENABLED": False,
+    "TESTING": True,
+    "WARM_UP": False,
+}
 
-app.config['WTF_CSRF_ENABLED'] = False
-app.config['TESTING'] = True
-app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app = create_app(TEST_CONFIG)
+
+# no background recipe searches; tests call refresh() themselves
+recommendation_queue.enabled = False
+recipe_prefetcher.enabled = False
+# see stored recipes at once rather than batching them
+recipe_matcher.rebuild_delay = 0
+
+
+def setUpModule():
+    db.create_all()
+
+
+def tearDownModule():
+    db.session.remove()
+    db.drop_all()
 
 
 class UserViewTestCase(TestCase):
@@ -20,6 +73,7 @@ class UserViewTestCase(TestCase):
         """Create test client, add sample data."""
 
         User.query.delete()
+        user_cache.clear()
 
         self.client = app.test_client()
 
@@ -103,6 +157,46 @@ class UserViewTestCase(TestCase):
         self.assertIn('test_user_edited', html)
         self.assertIn('test bio edited', html)
 
+    def test_rehash_on_login(self):
+        """
+        Is the stored hash upgraded when the work factor changes?
+        """
+        old_rounds = password_hasher.rounds
+        password_hasher.rounds = 5
+        try:
+            resp = self.client.post(
+                "/login", data={"username": "test_user", "password": "test_pwd"}, follow_redirects=True)
+        finally:
+            password_hasher.rounds = old_rounds
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("$05$", User.query.filter_by(username="test_user").one().password)
+
+    def test_cached_user(self):
+        """
+        Is the logged in user served from cache on repeat requests?
+        """
+        queries = []
+
+        def count_users_query(conn, cursor, statement, *args):
+            if "FROM users" in statement:
+                queries.append(statement)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+        event.listen(db.engine, "before_cursor_execute", count_users_query)
+        try:
+            c.get("/")
+            resp = c.get("/")
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count_users_query)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('test_user', resp.get_data(as_text=True))
+        self.assertEqual(len(queries), 1)
+
 
 class FridgeViewTestCase(TestCase):
     """Test views for fridge."""
@@ -110,8 +204,11 @@ class FridgeViewTestCase(TestCase):
     def setUp(self):
         """Create test client, add sample data."""
 
-        User.query.delete()
+        Fridge_Ingredients.query.delete()
         Fridge.query.delete()
+        User.query.delete()
+        user_cache.clear()
+        fridge_fragments.clear()
 
         self.client = app.test_client()
 
@@ -140,3 +237,1186 @@ class FridgeViewTestCase(TestCase):
         self.assertIn("Fridge created!", html)
         self.assertIsInstance(Fridge.query.filter_by(
             user_id=self.testuser.id).one(), Fridge)
+
+    def test_add_and_remove_ingredient(self):
+        """Can we add an ingredient, look up its fridge id and remove it?"""
+
+        fridge = Fridge(user_id=self.testuser.id)
+        db.session.add(fridge)
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+        c.post("/fridge/ingredient/add", json={"ing_id": 11282, "ing_name": "onion"})
+        resp = c.post("/fridge/ingredient/add", json={"ing_id": 11282, "ing_name": "onion"})
+        self.assertIn("already in fridge", resp.get_json())
+
+        ing_f_id = c.get("/fridge/ingredient/search/11282").get_json()
+        self.assertEqual(Fridge_Ingredients.query.get(ing_f_id).name, "onion")
+
+        resp = c.get("/")
+        self.assertIn(f'data-id="{ing_f_id}">onion', resp.get_data(as_text=True))
+
+        c.delete(f"/fridge/ingredient/remove/{ing_f_id}")
+        self.assertIsNone(Fridge_Ingredients.query.get(ing_f_id))
+
+    def test_batch_add_and_remove(self):
+        """Can we add and remove several ingredients in one request each?"""
+
+        fridge = Fridge(user_id=self.testuser.id)
+        db.session.add(fridge)
+        db.session.commit()
+        fridge_id = fridge.id
+        db.session.add(Fridge_Ingredients(fridge_id=fridge_id, ing_id=1, name="egg"))
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+        resp = c.post("/fridge/ingredients/add", json={"ingredients": [
+            {"ing_id": 1, "ing_name": "egg"},
+            {"ing_id": 2, "ing_name": "milk"},
+            {"ing_id": 3, "ing_name": "flour"},
+        ]})
+        data = resp.get_json()
+
+        self.assertEqual([i["name"] for i in data["added"]], ["milk", "flour"])
+        self.assertEqual([i["name"] for i in data["existing"]], ["egg"])
+        self.assertEqual(Fridge_Ingredients.query.filter_by(fridge_id=fridge_id).count(), 3)
+
+        ids = [i["id"] for i in data["added"]]
+        resp = c.post("/fridge/ingredients/remove", json={"ids": ids + [-1]})
+
+        self.assertEqual(sorted(resp.get_json()["removed"]), sorted(ids))
+        self.assertEqual(Fridge_Ingredients.query.filter_by(fridge_id=fridge_id).count(), 1)
+
+
+class IngredientSearchTestCase(TestCase):
+    """Test the local ingredient search index."""
+
+    def setUp(self):
+        """Build an index from a handful of sample ingredients."""
+
+        self.index = IngredientIndex()
+        self.index.load([
+            (1, "chicken breast"),
+            (2, "chicken stock"),
+            (3, "chickpeas"),
+            (4, "red onion"),
+            (5, "onion"),
+        ])
+
+    def test_prefix_search(self):
+        """Does a partial word match every ingredient starting with it?"""
+
+        names = [i['name'] for i in self.index.search("chick")]
+        self.assertEqual(names, ["chickpeas", "chicken stock", "chicken breast"])
+
+    def test_ranking(self):
+        """Does an exact name match rank ahead of partial matches?"""
+
+        names = [i['name'] for i in self.index.search("onion")]
+        self.assertEqual(names, ["onion", "red onion"])
+
+    def test_typo_search(self):
+        """Does a one letter typo still find the ingredient?"""
+
+        names = [i['name'] for i in self.index.search("chikcen stock")]
+        self.assertEqual(names, ["chicken stock"])
+
+    def test_incremental_update(self):
+        """Are added and removed ingredients reflected without a rebuild?"""
+
+        self.index.add(6, "onion powder")
+        self.index.remove(5)
+        names = [i['name'] for i in self.index.search("onion")]
+        self.assertEqual(names, ["onion powder", "red onion"])
+
+
+class ApiCacheTestCase(TestCase):
+    """Test the API response cache."""
+
+    def setUp(self):
+        """Wrap a fake API helper that counts its calls."""
+
+        self.cache = ResponseCache(maxsize=2)
+        self.calls = []
+
+        @cached("fake", ttl=60, cache=self.cache)
+        def fake_helper(query, number):
+            self.calls.append((query, number))
+            return [query, number]
+
+        self.helper = fake_helper
+
+    def test_cache_hit(self):
+        """Is a repeat call with equivalent arguments served from cache?"""
+
+        self.helper("Chicken", 10)
+        self.helper(" chicken ", number=10)
+
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(self.cache.stats()["fake"], {"misses": 1, "hits": 1})
+
+    def test_lru_eviction(self):
+        """Is the least recently used entry dropped once the cache is full?"""
+
+        self.helper("a", 1)
+        self.helper("b", 1)
+        self.helper("a", 1)
+        self.helper("c", 1)
+        self.helper("a", 1)
+        self.helper("b", 1)
+
+        self.assertEqual(self.calls, [("a", 1), ("b", 1), ("c", 1), ("b", 1)])
+
+    def test_key_excludes_api_key(self):
+        """Does the api key stay out of the cache key?"""
+
+        key = make_key("fake", {"query": "egg", "apiKey": "secret"})
+
+        self.assertNotIn("secret", str(key))
+
+    def test_expired_served_when_api_fails(self):
+        """Is an expired copy served when the API can't be reached?"""
+
+        failing = []
+
+        @cached("flaky", ttl=0, cache=self.cache)
+        def flaky_helper(query):
+            if failing:
+                raise UpstreamUnavailable("API circuit breaker is open")
+            return [query]
+
+        flaky_helper("egg")
+        failing.append(1)
+
+        self.assertEqual(flaky_helper("egg"), ["egg"])
+        self.assertEqual(self.cache.stats()["flaky"]["degraded_hits"], 1)
+        with self.assertRaises(UpstreamUnavailable):
+            flaky_helper("milk")
+
+
+class UpstreamClientTestCase(TestCase):
+    """Test the pooled API client against the fake API."""
+
+    def start(self, **options):
+        server, fake = fake_spoonacular.start(**options)
+        self.addCleanup(server.shutdown)
+        return fake
+
+    def test_retries_server_errors(self):
+        """Is a 500 retried, and the failure body returned once retries run out?"""
+
+        fake = self.start(error_rate=1.0)
+        client = UpstreamClient(fake.base_url, api_key="test", retries=2, backoff=0)
+
+        res = client.get_json("recipes/1/information")
+
+        self.assertEqual(res["code"], 500)
+        self.assertEqual(fake.calls, 3)
+
+    def test_timeout(self):
+        """Does a slow answer fail after one read timeout, without retries?"""
+
+        fake = self.start(latency=2)
+        client = UpstreamClient(fake.base_url, api_key="test", timeout=(1, 0.3), retries=2)
+
+        start = time.monotonic()
+        with self.assertRaises(requests.RequestException):
+            client.get("recipes/1/information")
+        self.assertLess(time.monotonic() - start, 0.6)
+        self.assertEqual(fake.calls, 1)
+
+    def test_connections_reused(self):
+        """Do calls one after another share a single kept-alive connection?"""
+
+        fake = self.start()
+        client = UpstreamClient(fake.base_url, api_key="test", pool_size=2)
+
+        for id in range(5):
+            self.assertEqual(client.get_json(f"recipes/{id}/information")["id"], id)
+
+        pool = client.session.get_adapter(fake.base_url).poolmanager.connection_from_url(
+            fake.base_url)
+        self.assertEqual(pool.num_connections, 1)
+        self.assertEqual(pool.num_requests, 5)
+
+    def test_gather(self):
+        """Are calls run side by side, results in order, and degraded marks kept?"""
+
+        fake = self.start(latency=0.3)
+        client = UpstreamClient(fake.base_url, api_key="test")
+
+        def degraded():
+            mark_degraded()
+            return "stale"
+
+        with app.test_request_context():
+            start = time.monotonic()
+            results = client.gather(
+                *(lambda id=id: client.get_json(f"recipes/{id}/information")["id"]
+                  for id in range(4)))
+            self.assertLess(time.monotonic() - start, 1)
+            self.assertEqual(results, [0, 1, 2, 3])
+            self.assertFalse(is_degraded())
+
+            self.assertEqual(client.gather(degraded, lambda: "fresh"), ["stale", "fresh"])
+            self.assertTrue(is_degraded())
+
+        with self.assertRaises(ZeroDivisionError):
+            client.gather(lambda: 1, lambda: 1 / 0)
+
+
+class RecipeModelTestCase(TestCase):
+    """Test stored recipes."""
+
+    def setUp(self):
+        """Store a sample recipe."""
+
+        RecipeStep.query.delete()
+        Recipe.query.delete()
+
+        self.info = {"id": 42, "title": "Pancakes", "image": "pancakes.jpg"}
+        self.instructions = [
+            {"name": "", "steps": [{"number": 1, "step": "Mix."}, {"number": 2, "step": "Fry."}]},
+            {"name": "Serve", "steps": [{"number": 1, "step": "Eat."}]},
+        ]
+        Recipe.store(self.info, self.instructions)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_get_fresh(self):
+        """Is a freshly stored recipe returned with its steps in order?"""
+
+        recipe = Recipe.get_fresh(42, timedelta(days=1))
+
+        self.assertEqual(recipe.title, "Pancakes")
+        self.assertEqual(recipe.info, self.info)
+        self.assertEqual(recipe.instructions, ["Mix.", "Fry.", "Eat."])
+
+    def test_get_stale(self):
+        """Is a recipe older than the refresh age treated as missing?"""
+
+        self.assertIsNone(Recipe.get_fresh(42, timedelta(seconds=-1)))
+
+    def test_store_refresh(self):
+        """Does storing a recipe again replace its info and steps?"""
+
+        Recipe.store({"id": 42, "title": "Crepes"}, [{"steps": [{"step": "Flip."}]}])
+        db.session.commit()
+
+        recipe = Recipe.get_fresh(42, timedelta(days=1))
+        self.assertEqual(recipe.title, "Crepes")
+        self.assertEqual(recipe.instructions, ["Flip."])
+
+
+def corpus_recipe(id, ing_ids, likes=0):
+    return {"id": id, "title": f"Recipe {id}", "image": f"{id}.jpg", "aggregateLikes": likes,
+            "extendedIngredients": [{"id": i, "name": f"ing {i}"} for i in ing_ids]}
+
+
+class RecipeMatcherTestCase(TestCase):
+    """Test the local by-ingredient recipe search."""
+
+    def setUp(self):
+        """Load a small corpus into a matcher of its own."""
+
+        RecipeStep.query.delete()
+        Recipe.query.delete()
+        db.session.commit()
+        recipe_matcher.clear()
+
+        fd, self.path = tempfile.mkstemp(suffix=".jsonl")
+        with os.fdopen(fd, "w") as f:
+            for rcp in [
+                corpus_recipe(1, [10, 11, 12]),
+                corpus_recipe(2, [10, 11], likes=1),
+                corpus_recipe(3, [10, 13], likes=9),
+                corpus_recipe(4, [13, 14]),
+                corpus_recipe(5, [10, 11, 14], likes=5),
+            ]:
+                f.write(json.dumps(rcp) + "\n")
+        self.matcher = RecipeMatcher(corpus_path=self.path)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_ranking(self):
+        """Most used first, then fewest missed, then most liked?"""
+
+        rcps = self.matcher.match([10, 11, 99], number=10)
+
+        self.assertEqual([r["id"] for r in rcps], [2, 5, 1, 3])
+        self.assertEqual(rcps[0]["usedIngredientCount"], 2)
+        self.assertEqual(rcps[0]["missedIngredientCount"], 0)
+        self.assertEqual([i["name"] for i in rcps[1]["usedIngredients"]], ["ing 10", "ing 11"])
+        self.assertEqual([i["id"] for i in rcps[1]["missedIngredients"]], [14])
+        self.assertEqual(self.matcher.match([10, 11], number=2), rcps[:2])
+        self.assertEqual(self.matcher.match([99]), [])
+
+    def test_stored_recipes(self):
+        """Are recipes stored in the Recipe table matched too, once stored?"""
+
+        self.assertEqual([r["id"] for r in self.matcher.match([14])], [4, 5])
+
+        Recipe.store(corpus_recipe(6, [14]), [])
+        db.session.commit()
+        self.assertEqual([r["id"] for r in recipe_matcher.match([14])], [6])
+
+    def test_rebuilt_in_background(self):
+        """Are changes searched once rebuilt off the request, the old build serving meanwhile?"""
+
+        self.assertEqual([r["id"] for r in self.matcher.match([14])], [4, 5])
+        self.matcher.add(corpus_recipe(7, [14], likes=99))
+        self.matcher.rebuild_delay = 0.2
+
+        # the search that notices the change isn't held up by it
+        self.assertEqual([r["id"] for r in self.matcher.match([14])], [4, 5])
+        deadline = time.monotonic() + 5
+        while self.matcher._rebuilding and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual([r["id"] for r in self.matcher.match([14])], [7, 4, 5])
+
+
+class SingleFlightTestCase(TestCase):
+    """Test coalescing of identical in-flight calls."""
+
+    def test_concurrent_calls_share_fetch(self):
+        """Do callers arriving mid-fetch get the first caller's result?"""
+
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return "result"
+
+        with ThreadPoolExecutor(max_workers=5) as pool:
+            leader = pool.submit(flight.do, ("fake", ()), fetch)
+            started.wait(5)
+            followers = [pool.submit(flight.do, ("fake", ()), fetch) for _ in range(4)]
+            while flight.stats()["fake"].get("collapsed", 0) < 4:
+                time.sleep(0.01)
+            release.set()
+            results = [leader.result()] + [f.result() for f in followers]
+
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, ["result"] * 5)
+        self.assertEqual(flight.stats()["fake"], {"leaders": 1, "collapsed": 4})
+
+
+    def test_shared_across_workers(self):
+        """Is a result reused by another worker, but an error not, and are old files purged?"""
+
+        lock_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, lock_dir)
+        first = SingleFlight(lock_dir=lock_dir, share_ttl=0.2, purge_interval=0)
+        second = SingleFlight(lock_dir=lock_dir, share_ttl=0.2, purge_interval=0)
+        share = lambda value: value != "error"
+
+        self.assertEqual(first.do("failing", lambda: "error", share=share), "error")
+        self.assertEqual(second.do("failing", lambda: "fresh", share=share), "fresh")
+
+        first.do("ok", lambda: "result", share=share)
+        self.assertEqual(second.do("ok", lambda: self.fail("fetched again")), "result")
+
+        # the next leader deletes results past share_ttl, then leaves its own
+        time.sleep(0.25)
+        first.do("other", lambda: "x")
+        results = [name for name in os.listdir(lock_dir) if name.endswith(".json")]
+        self.assertEqual(len(results), 1)
+
+
+class UpstreamGuardTestCase(TestCase):
+    """Test the API rate limiter and circuit breaker."""
+
+    def test_rate_limit_and_quota(self):
+        """Are calls past the burst refused, and none allowed past the quota?"""
+
+        limiter = RateLimiter(rate=1, burst=2, daily_quota=3, max_wait=0)
+
+        self.assertIsNone(limiter.acquire())
+        self.assertIsNone(limiter.acquire())
+        self.assertEqual(limiter.acquire(), "API rate limit reached")
+        self.assertEqual(limiter.remaining(), 1)
+
+        limiter.record_usage(3)
+        self.assertEqual(limiter.acquire(), "daily API quota used up")
+
+    def test_shared_limiter_state(self):
+        """Do two limiters on the same state file draw from one bucket?"""
+
+        state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, state_dir)
+        path = os.path.join(state_dir, "limit.json")
+        first = RateLimiter(rate=0.001, burst=2, max_wait=0, state_path=path)
+        second = RateLimiter(rate=0.001, burst=2, max_wait=0, state_path=path)
+
+        self.assertIsNone(first.acquire())
+        self.assertIsNone(second.acquire())
+        self.assertIsNotNone(first.acquire())
+
+    def test_breaker_fails_fast(self):
+        """Does the breaker refuse calls after repeated failures, then let one trial through?"""
+
+        guard = UpstreamGuard(breaker=CircuitBreaker(failure_threshold=2, reset_timeout=0.05))
+        for _ in range(2):
+            guard.before_call()
+            guard.after_call(None)
+
+        self.assertFalse(guard.available())
+        with self.assertRaises(UpstreamUnavailable):
+            guard.before_call()
+
+        time.sleep(0.06)
+        guard.before_call()
+        # only one trial at a time
+        with self.assertRaises(UpstreamUnavailable):
+            guard.before_call()
+        guard.after_call(app.response_class(status=200))
+        self.assertEqual(guard.breaker.state, "closed")
+
+    def test_on_wait_error_keeps_trial(self):
+        """Does a failing on_wait leave the half-open trial for the next call?"""
+
+        guard = UpstreamGuard(breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0.05))
+        guard.before_call()
+        guard.after_call(None)
+        time.sleep(0.06)
+
+        def on_wait():
+            raise SQLAlchemyError("commit failed")
+
+        client = UpstreamClient("http://127.0.0.1:9/", guard=guard, on_wait=on_wait)
+        with self.assertRaises(SQLAlchemyError):
+            client.get("recipes/1/information")
+        self.assertEqual(guard.breaker.state, "half-open")
+        guard.before_call()
+
+
+class RecipeViewTestCase(TestCase):
+    """Test views for recipes."""
+
+    def setUp(self):
+        """Create test client, a user with a fridge and a stored recipe."""
+
+        FridgeRecommendation.query.delete()
+        Fridge_Ingredients.query.delete()
+        Fridge.query.delete()
+        User.query.delete()
+        RecipeStep.query.delete()
+        Recipe.query.delete()
+        user_cache.clear()
+        api_cache.clear()
+        fridge_fragments.clear()
+        recipe_matcher.clear()
+
+        self.client = app.test_client()
+
+        self.testuser = User.signup(
+            username='test_user',
+            email='test_user@test.com',
+            password='test_pwd',
+            avatar_img='default_img',
+            bio='test bio',
+        )
+        db.session.commit()
+        self.testuser_id = self.testuser.id
+
+        fridge = Fridge(user_id=self.testuser_id)
+        db.session.add(fridge)
+        db.session.commit()
+        self.fridge_id = fridge.id
+        db.session.add(Fridge_Ingredients(fridge_id=fridge.id, ing_id=1123, name="egg"))
+        Recipe.store({
+            "id": 1, "title": "Omelette", "image": "omelette.jpg", "aggregateLikes": 5,
+            "extendedIngredients": [{"id": 1123, "name": "egg"}, {"id": 1077, "name": "milk"}],
+        }, [])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_stream_search(self):
+        """Are stored recipes streamed before (and not repeated by) the API's?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+        api_rcps = [{"id": 2, "title": "Frittata"}, {"id": 1, "title": "Omelette"}]
+        with patch("app.spoonacular.get_json", return_value=api_rcps) as get_json:
+            resp = c.get("/recipe/search?stream=1")
+            lines = resp.get_data(as_text=True).splitlines()
+
+        rcps = [json.loads(line) for line in lines]
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        self.assertEqual([r["title"] for r in rcps], ["Omelette", "Frittata"])
+        self.assertEqual(rcps[0]["usedIngredientCount"], 1)
+        self.assertEqual(rcps[0]["missedIngredientCount"], 1)
+        get_json.assert_called_once()
+
+    def test_degraded_search(self):
+        """Are stored recipes served, and flagged, when the API is unavailable?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+        down = UpstreamUnavailable("API circuit breaker is open")
+        with patch("app.spoonacular.get_json", side_effect=down):
+            resp = c.get("/recipe/search")
+            ings = c.get("/ingredient/search/zzz&5")
+
+        self.assertEqual(resp.headers[DEGRADED_HEADER], "1")
+        self.assertEqual([r["title"] for r in resp.json], ["Omelette"])
+        self.assertEqual(ings.headers[DEGRADED_HEADER], "1")
+        self.assertEqual(ings.json, [])
+        self.assertTrue(ings.cache_control.no_cache)
+
+        fine = c.get("/recipe/check-out/1")
+        self.assertNotIn(DEGRADED_HEADER, fine.headers)
+
+    def test_ingredient_search_session(self):
+        """Does an ingredient search leave the stored session alone?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+        stored = db.session.query(ServerSession.data).all()
+        found = {"results": [{"id": 1123, "name": "egg"}]}
+        with patch("app.spoonacular.get_json", return_value=found):
+            self.assertEqual(c.get("/ingredient/search/zzz&5").json, found["results"])
+        self.assertEqual(db.session.query(ServerSession.data).all(), stored)
+
+    def test_local_search(self):
+        """Is a full page of locally matched recipes served without the API?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+        for id in range(100, 110):
+            recipe_matcher.add(corpus_recipe(id, [1123, 2000 + id]))
+        with patch("app.spoonacular.get_json") as get_json:
+            rcps = c.get("/recipe/search").json
+            lines = c.get("/recipe/search?stream=1").get_data(as_text=True).splitlines()
+            get_json.assert_not_called()
+
+        self.assertEqual(len(rcps), 10)
+        self.assertEqual(rcps[0]["title"], "Omelette")
+        self.assertEqual(len(lines), 10)
+
+    def test_precomputed_search(self):
+        """Are stored recommendations served until the fridge changes?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+        api_rcps = [{"id": 2, "title": "Frittata", "image": "f.jpg", "likes": 3}]
+        with patch("app.spoonacular.get_json", return_value=api_rcps):
+            recommendation_queue.refresh(self.fridge_id)
+
+        with patch("app.spoonacular.get_json") as get_json:
+            resp = c.get("/recipe/search")
+            self.assertEqual(resp.json, api_rcps)
+            self.assertIn("Frittata", c.get("/").get_data(as_text=True))
+            get_json.assert_not_called()
+
+        c.post("/fridge/ingredients/add",
+               json={"ingredients": [{"ing_id": 1077, "ing_name": "milk"}]})
+        self.assertIsNone(recommendation_queue.current(self.fridge_id, "egg,milk"))
+        with patch("app.spoonacular.get_json", return_value=[]) as get_json:
+            self.assertEqual(c.get("/recipe/search").json, [])
+            get_json.assert_called_once()
+
+    def test_conditional_homepage(self):
+        """Is an unchanged homepage a 304, and a changed fridge a new page?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+        first = c.get("/")
+        etag = first.headers["ETag"]
+        self.assertTrue(etag.startswith("W/"))
+        self.assertIn("egg", first.get_data(as_text=True))
+
+        again = c.get("/", headers={"If-None-Match": etag})
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.get_data(), b"")
+
+        c.post("/fridge/ingredients/add",
+               json={"ingredients": [{"ing_id": 1077, "ing_name": "milk"}]})
+        changed = c.get("/", headers={"If-None-Match": etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers["ETag"], etag)
+        self.assertIn("milk", changed.get_data(as_text=True))
+
+    def test_conditional_recipe(self):
+        """Is a recipe page we already sent answered with a 304?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+        first = c.get("/recipe/check-out/1")
+        self.assertEqual(first.status_code, 200)
+        self.assertIsNotNone(first.last_modified)
+
+        by_etag = c.get("/recipe/check-out/1", headers={"If-None-Match": first.headers["ETag"]})
+        by_date = c.get("/recipe/check-out/1",
+                        headers={"If-Modified-Since": first.headers["Last-Modified"]})
+        self.assertEqual(by_etag.status_code, 304)
+        self.assertEqual(by_date.status_code, 304)
+
+    def test_compressed_recipe_page(self):
+        """Is the recipe page gzipped for clients that accept it, and privately cacheable?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+        plain = c.get("/recipe/check-out/1")
+        gzipped = c.get("/recipe/check-out/1", headers={"Accept-Encoding": "gzip, deflate"})
+
+        self.assertNotIn("Content-Encoding", plain.headers)
+        self.assertEqual(gzipped.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(gzipped.get_data()), plain.get_data())
+        self.assertIn("Accept-Encoding", gzipped.headers["Vary"])
+        self.assertTrue(gzipped.cache_control.private)
+        self.assertEqual(gzipped.cache_control.max_age, 3600)
+
+        with patch("app.spoonacular.get_json", return_value=[]):
+            streamed = c.get("/recipe/search?stream=1", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", streamed.headers)
+
+    def test_prefetched_check_out(self):
+        """Is a searched recipe stored in the background, ready for check-out?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+        def fake_api(path, params=None):
+            if path == "recipes/findByIngredients":
+                return [{"id": 2, "title": "Frittata"}, {"id": 1, "title": "Omelette"}]
+            if path == "recipes/2/information":
+                return {"id": 2, "title": "Frittata", "image": "f.jpg"}
+            return [{"steps": [{"number": 1, "step": "Whisk the eggs."}]}]
+
+        recipe_prefetcher.enabled = True
+        try:
+            with patch("app.spoonacular.get_json", side_effect=fake_api) as get_json:
+                c.get("/recipe/search")
+                deadline = time.monotonic() + 5
+                while recipe_prefetcher.pending() and time.monotonic() < deadline:
+                    time.sleep(0.01)
+                # recipe 1 is stored already, only 2 is fetched
+                self.assertEqual(get_json.call_count, 3)
+        finally:
+            recipe_prefetcher.enabled = False
+
+        with patch("app.spoonacular.get_json") as get_json:
+            page = c.get("/recipe/check-out/2").get_data(as_text=True)
+            get_json.assert_not_called()
+        self.assertIn("Whisk the eggs.", page)
+
+    def test_recommendations_local_first(self):
+        """Is a full local page stored without the API, and a failure backed off?"""
+
+        for id in range(100, 110):
+            recipe_matcher.add(corpus_recipe(id, [1123]))
+        with patch("app.spoonacular.get_json") as get_json:
+            self.assertEqual(len(recommendation_queue.refresh(self.fridge_id)), 10)
+            get_json.assert_not_called()
+
+        queue = RecommendationQueue(retry_delay=60)
+        queue.init_app(app, search=lambda query, ingredients, number: None)
+        self.assertIsNone(queue.refresh(self.fridge_id))
+        self.assertGreater(queue._retry_at, time.monotonic() + 50)
+        self.assertIsNotNone(recommendation_queue.current(self.fridge_id, "egg"))
+
+    def test_recommendations_debounced(self):
+        """Does a burst of fridge changes cost a single search?"""
+
+        calls = []
+        queue = RecommendationQueue()
+        queue.init_app(app, search=lambda query, ingredients, number: calls.append(query) or [])
+        # init_app read the app's debounce, keep the test quick
+        queue.debounce = 0.05
+        for _ in range(5):
+            queue.schedule(self.fridge_id)
+        deadline = time.monotonic() + 5
+        while queue.pending() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        self.assertEqual(calls, ["egg"])
+        self.assertEqual(queue.current(self.fridge_id, "egg").results, [])
+
+
+class RecipePrefetcherTestCase(TestCase):
+    """Test the background recipe prefetch pool."""
+
+    def test_rank_dedupe_and_drop(self):
+        """Best ranks first, no id twice, and the worst pushed out when full?"""
+
+        started, release, fetched = threading.Event(), threading.Event(), []
+
+        def fetch(id):
+            fetched.append(id)
+            started.set()
+            release.wait(5)
+
+        prefetcher = RecipePrefetcher(number=3, max_workers=1, max_queue=3)
+        prefetcher.init_app(app, fetch)
+        # init_app read the app's config, keep the sizes above
+        prefetcher.number, prefetcher.max_workers, prefetcher.max_queue = 3, 1, 3
+
+        prefetcher.prefetch([1, 2, 3])
+        self.assertTrue(started.wait(5))
+        # 1 is being fetched and 2 is waiting, only 4 is new
+        prefetcher.prefetch([1, 4, 2])
+        # the queue is full (2, 3, 4), 3 ranks lowest and makes room
+        prefetcher.prefetch([5])
+        release.set()
+        deadline = time.monotonic() + 5
+        while prefetcher.pending() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        # 5 ranks first, then the newer of the second best
+        self.assertEqual(fetched, [1, 5, 4, 2])
+        self.assertEqual(prefetcher.stats(), {"recipe": {
+            "queued": 5, "deduped": 2, "dropped": 1, "done": 4}})
+
+
+class SeedTestCase(TestCase):
+    """Test loading CSV files with seed.py."""
+
+    def setUp(self):
+        FridgeRecommendation.query.delete()
+        Fridge_Ingredients.query.delete()
+        Fridge.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.pool = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(self.pool.shutdown)
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def write_csv(self, name, text):
+        path = os.path.join(self.dir, name)
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    def test_load(self):
+        """Are rows upserted with hashed passwords, and bad files handled?"""
+
+        loader = seed.Loader(chunk_size=1, rounds=4, pool=self.pool)
+        users = self.write_csv("users.csv", (
+            "username,email,password,avatar_img,bio\n"
+            "ann,ann@test.com,ann_pwd,,\n"
+            "bob,bob@test.com,bob_pwd,,hi\n"))
+
+        self.assertEqual(loader.load("users", users), 2)
+        # loading again updates the same rows
+        self.assertEqual(loader.load("users", users), 2)
+        self.assertEqual(User.query.count(), 2)
+        ann = User.query.filter_by(username="ann").one()
+        self.assertTrue(User.authenticate("ann", "ann_pwd"))
+        self.assertNotEqual(ann.password, "ann_pwd")
+
+        empty = self.write_csv("empty.csv", "id,name\n")
+        self.assertEqual(loader.load("ingredients", empty), 0)
+
+        bad = self.write_csv("bad.csv", "id,name,colour\n1,egg,white\n")
+        with self.assertRaises(ValueError):
+            loader.load("ingredients", bad)
+
+    def test_taken_ids_refused(self):
+        """Is a row whose explicit id belongs to another user refused, and a rerun not?"""
+
+        loader = seed.Loader(chunk_size=10, rounds=4, pool=self.pool)
+        first = self.write_csv("first.csv", "username,email,password\nann,ann@test.com,pwd\n")
+        loader.load("users", first)
+        ann_id = User.query.filter_by(username="ann").one().id
+
+        same = self.write_csv("same.csv", f"id,username,email,password\n{ann_id},ann,a@b.com,pwd\n")
+        self.assertEqual(loader.load("users", same), 1)
+        other = self.write_csv("other.csv", f"id,username,email,password\n{ann_id},zed,z@b.com,pwd\n")
+        with self.assertRaises(ValueError):
+            loader.load("users", other)
+        self.assertEqual(User.query.count(), 1)
+
+
+class PasswordHasherTestCase(TestCase):
+    """Test the bounded password hashing pool."""
+
+    def test_hash_and_check(self):
+        """Does a hash verify its own password and no other?"""
+
+        hasher = PasswordHasher(rounds=4)
+        hashed = hasher.hash("test_pwd")
+
+        self.assertTrue(hasher.check(hashed, "test_pwd"))
+        self.assertFalse(hasher.check(hashed, "wrong_pwd"))
+        self.assertFalse(hasher.check("plaintext", "plaintext"))
+        self.assertFalse(hasher.needs_rehash(hashed))
+        hasher.rounds = 5
+        self.assertTrue(hasher.needs_rehash(hashed))
+
+    def test_backpressure(self):
+        """Is HashingBusy raised instead of queueing past max_pending?"""
+
+        hasher = PasswordHasher(rounds=4, max_pending=1, wait_timeout=0.01)
+        hasher._slots.acquire()
+        try:
+            with self.assertRaises(HashingBusy):
+                hasher.hash("test_pwd")
+        finally:
+            hasher._slots.release()
+
+
+class ReplicaRoutingTestCase(TestCase):
+    """Test read replica routing against a second SQLite database."""
+
+    def setUp(self):
+        """Create the user on the primary, and an out of date copy on the replica."""
+
+        Fridge.query.delete()
+        User.query.delete()
+        db.session.commit()
+        user_cache.clear()
+        fridge_fragments.clear()
+
+        user = User.signup(username='test_user', email='test_user@test.com',
+                           password='test_pwd', avatar_img='default_img', bio='primary bio')
+        db.session.commit()
+        self.testuser_id = user.id
+
+        self.replica_dir = tempfile.mkdtemp()
+        app.config["SQLALCHEMY_BINDS"] = {
+            "replica": "sqlite:///" + os.path.join(self.replica_dir, "replica.db")}
+        replica = db.get_engine(app, bind="replica")
+        db.Model.metadata.create_all(replica)
+        replica.execute(User.__table__.insert(), id=user.id, username='test_user',
+                        email='test_user@test.com', password=user.password,
+                        avatar_img='default_img', bio='replica bio')
+        db.session.remove()
+
+    def tearDown(self):
+        db.session.remove()
+        db.get_engine(app, bind="replica").dispose()
+        get_state(app).connectors.pop("replica")
+        app.config["SQLALCHEMY_BINDS"] = None
+        shutil.rmtree(self.replica_dir)
+        user_cache.clear()
+
+    def logged_in_client(self):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.testuser_id
+        return client
+
+    def test_reads_from_replica(self):
+        """Are a page's reads served by the replica?"""
+
+        html = self.logged_in_client().get("/").get_data(as_text=True)
+
+        self.assertIn("replica bio", html)
+        self.assertIn("Create your fridge", html)
+
+    def test_read_your_writes(self):
+        """Does a browser that just wrote read from the primary, and only that browser?"""
+
+        client = self.logged_in_client()
+        resp = client.post("/fridge/create")
+        self.assertIn(PIN_COOKIE, resp.headers.get("Set-Cookie", ""))
+        fridges = Fridge.__table__.select().where(Fridge.user_id == self.testuser_id)
+        self.assertEqual(len(db.engine.execute(fridges).fetchall()), 1)
+        # not replicated, the test replica never catches up
+        self.assertEqual(Fridge.query.filter_by(user_id=self.testuser_id).count(), 0)
+
+        user_cache.clear()
+        html = client.get("/").get_data(as_text=True)
+        self.assertIn("primary bio", html)
+        self.assertNotIn("Create your fridge", html)
+
+        user_cache.clear()
+        other = self.logged_in_client().get("/").get_data(as_text=True)
+        self.assertIn("replica bio", other)
+
+    def test_writes_go_to_primary(self):
+        """Are updates, and reads after them in the same session, on the primary?"""
+
+        with app.test_request_context():
+            self.assertEqual(User.query.get(self.testuser_id).bio, "replica bio")
+            User.query.filter_by(id=self.testuser_id).update({"bio": "new bio"})
+            self.assertEqual(
+                db.session.query(User.bio).filter_by(id=self.testuser_id).scalar(), "new bio")
+            db.session.commit()
+
+
+class ServerSessionTestCase(TestCase):
+    """Test server side session storage."""
+
+    def setUp(self):
+        ServerSession.query.delete()
+        db.session.commit()
+        self.client = app.test_client()
+
+    def test_session_stored_server_side(self):
+        """Does the cookie hold only an id while the data sits in the db?"""
+
+        big = [[i, f"ingredient {i}"] for i in range(500)]
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess['big'] = big
+
+            cookie = next(ck for ck in c.cookie_jar if ck.name == app.session_cookie_name)
+            self.assertLess(len(cookie.value), 64)
+            self.assertEqual(ServerSession.query.count(), 1)
+
+            with c.session_transaction() as sess:
+                self.assertEqual(sess['big'], big)
+
+    def test_new_id_at_login_and_logout(self):
+        """Is a session id from before login (a planted one, say) useless after?"""
+
+        FridgeRecommendation.query.delete()
+        Fridge_Ingredients.query.delete()
+        Fridge.query.delete()
+        User.query.delete()
+        User.signup(username="sid_user", email="sid@test.com", password="sid_pwd",
+                    avatar_img="default_img", bio="")
+        db.session.commit()
+        user_cache.clear()
+
+        def sid(c):
+            return next(ck.value for ck in c.cookie_jar if ck.name == app.session_cookie_name)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess["planted"] = True
+            planted = sid(c)
+
+            c.post("/login", data={"username": "sid_user", "password": "sid_pwd"})
+            logged_in = sid(c)
+            self.assertNotEqual(logged_in, planted)
+            self.assertEqual(ServerSession.query.filter_by(id=planted).count(), 0)
+            with c.session_transaction() as sess:
+                self.assertIn(CURR_USER_KEY, sess)
+
+            c.get("/logout")
+            self.assertNotEqual(sid(c), logged_in)
+            self.assertEqual(ServerSession.query.filter_by(id=logged_in).count(), 0)
+
+    def test_empty_session_not_stored(self):
+        """Are anonymous visits served without storing a session?"""
+
+        self.client.get("/login")
+
+        self.assertEqual(ServerSession.query.count(), 0)
+
+
+class MetricsTestCase(TestCase):
+    """Test the /metrics endpoint."""
+
+    def test_metrics(self):
+        """Are request, SQL and template timings exposed for Prometheus?"""
+
+        client = app.test_client()
+        client.get("/login")
+        resp = client.get("/metrics")
+        text = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('cookwhat_request_seconds_count{endpoint="views.login",method="GET",status="200"}', text)
+        self.assertIn('cookwhat_template_render_seconds_count{template="/users/login.html"}', text)
+        self.assertIn('cookwhat_sql_statements_per_request_count{endpoint="views.login"}', text)
+
+    def test_mixed_status_labels(self):
+        """Are int and "error" statuses of one endpoint exposed side by side?"""
+
+        metrics.observe_upstream("recipes/1/information", 200, 0.1)
+        metrics.observe_upstream("recipes/2/information", "error", 3.0)
+
+        text = app.test_client().get("/metrics").get_data(as_text=True)
+        self.assertIn('cookwhat_upstream_seconds_count{endpoint="recipes/{id}/information",status="200"}', text)
+        self.assertIn('cookwhat_upstream_seconds_count{endpoint="recipes/{id}/information",status="error"}', text)
+
+    def test_families_once(self):
+        """Does building the app again leave each metric family listed once?"""
+
+        create_app(TEST_CONFIG)
+        text = app.test_client().get("/metrics").get_data(as_text=True)
+
+        families = [line.split()[2] for line in text.splitlines() if line.startswith("# TYPE")]
+        self.assertEqual(len(families), len(set(families)))
+        self.assertIn("cookwhat_api_cache_total", families)
+
+    def test_token_required(self):
+        """Outside debug and testing, is /metrics refused without its token?"""
+
+        client = app.test_client()
+        try:
+            metrics.public, metrics.token = False, None
+            self.assertEqual(client.get("/metrics").status_code, 403)
+            metrics.token = "secret"
+            self.assertEqual(client.get("/metrics").status_code, 401)
+            ok = client.get("/metrics", headers={"Authorization": "Bearer secret"})
+            self.assertEqual(ok.status_code, 200)
+        finally:
+            metrics.public, metrics.token = True, None
+
+
+class ImageProxyTestCase(TestCase):
+    """Test the recipe image proxy against the fake API's image stub."""
+
+    def setUp(self):
+        self.server, self.fake = fake_spoonacular.start()
+        self.cache_dir = tempfile.mkdtemp()
+        self.saved = (image_proxy.cache_dir, image_proxy.allowed_hosts, image_proxy.flight)
+        image_proxy.cache_dir = self.cache_dir
+        image_proxy.allowed_hosts = ("127.0.0.1",)
+        image_proxy.flight = SingleFlight()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        self.server.shutdown()
+        image_proxy.cache_dir, image_proxy.allowed_hosts, image_proxy.flight = self.saved
+        shutil.rmtree(self.cache_dir)
+
+    def test_fetch_once_and_serve_from_disk(self):
+        """Is an image fetched once, then served from the cache with long lived headers?"""
+
+        url = image_proxy.proxy_url(self.fake.image(42))
+        self.assertTrue(url.startswith("/img/"))
+
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.mimetype, "image/gif")
+        self.assertEqual(first.get_data(), fake_spoonacular.PIXEL_GIF)
+        self.assertIn("immutable", first.headers["Cache-Control"])
+
+        self.server.shutdown()
+        again = self.client.get(url)
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(again.get_data(), fake_spoonacular.PIXEL_GIF)
+
+    def test_content_addressed(self):
+        """Do two urls with the same bytes share one stored blob?"""
+
+        for id in (1, 2):
+            self.client.get(image_proxy.proxy_url(self.fake.image(id)))
+
+        blobs = [f for _, _, files in os.walk(os.path.join(self.cache_dir, "blobs")) for f in files]
+        self.assertEqual(len(blobs), 1)
+
+    def test_only_allowed_hosts(self):
+        """Are other hosts left alone, and unknown keys a 404?"""
+
+        self.assertEqual(image_proxy.proxy_url("https://evil.example.com/a.jpg"),
+                         "https://evil.example.com/a.jpg")
+        self.assertEqual(self.client.get("/img/" + "0" * 40).status_code, 404)
+
+    def test_redirects_stay_on_allowed_hosts(self):
+        """Is a redirect to an allowed host followed, and one elsewhere refused?"""
+
+        image = self.fake.image(7)
+        allowed = self.fake.base_url + "imageRedirect?" + urlencode({"to": image})
+        elsewhere = self.fake.base_url + "imageRedirect?" + urlencode(
+            {"to": image.replace("127.0.0.1", "localhost")})
+
+        self.assertEqual(self.client.get(image_proxy.proxy_url(allowed)).status_code, 200)
+        self.assertEqual(self.client.get(image_proxy.proxy_url(elsewhere)).status_code, 502)
+
+    def test_known_keys_bounded(self):
+        """Does proxy_url keep only the latest known_size keys in memory?"""
+
+        proxy = ImageProxy(cache_dir=self.cache_dir, allowed_hosts=("127.0.0.1",), known_size=2)
+        urls = [proxy.proxy_url(self.fake.image(id)) for id in range(5)]
+
+        self.assertEqual(len(proxy._known), 2)
+        # forgotten keys still have their ref on disk
+        self.assertEqual(self.client.get(urls[0]).status_code, 200)
+
+    def test_eviction(self):
+        """Are the least recently served blobs evicted past the size limit?"""
+
+        proxy = ImageProxy(cache_dir=self.cache_dir, max_bytes=250)
+        for n in range(3):
+            path = proxy._blob_path(f"{n:02d}" + "a" * 62)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(b"x" * 100)
+            os.utime(path, (1000 + n, 1000 + n))
+        proxy._grow(100)
+
+        self.assertFalse(os.path.exists(proxy._blob_path("00" + "a" * 62)))
+        self.assertTrue(os.path.exists(proxy._blob_path("02" + "a" * 62)))
+
+
+class ConcurrencyTestCase(TestCase):
+    """Test that one process serves many requests waiting on a slow API."""
+
+    def setUp(self):
+        FridgeRecommendation.query.delete()
+        Fridge_Ingredients.query.delete()
+        Fridge.query.delete()
+        User.query.delete()
+        db.session.commit()
+        user_cache.clear()
+        api_cache.clear()
+
+        self.server, self.fake = fake_spoonacular.start(latency=0.5)
+        self.saved = (spoonacular.base_url, upstream_guard.limiter)
+        spoonacular.base_url = self.fake.base_url
+        upstream_guard.limiter = RateLimiter(rate=1000, burst=1000)
+
+        user = User.signup(username='test_user', email='test_user@test.com',
+                           password='test_pwd', avatar_img='default_img', bio='test bio')
+        db.session.commit()
+        self.testuser_id = user.id
+
+    def tearDown(self):
+        self.server.shutdown()
+        spoonacular.base_url, upstream_guard.limiter = self.saved
+        db.session.rollback()
+
+    def test_many_requests_in_flight(self):
+        """Do 200 searches, each waiting half a second on the API, overlap?"""
+
+        def search(n):
+            client = app.test_client()
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+            return client.get(f"/ingredient/search/zzq{n}&3")
+
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=200) as pool:
+            responses = list(pool.map(search, range(200)))
+        elapsed = time.monotonic() - start
+
+        self.assertEqual([r.status_code for r in responses], [200] * 200)
+        self.assertFalse(any(DEGRADED_HEADER in r.headers for r in responses))
+        self.assertEqual(self.fake.calls, 200)
+        # one at a time this would take 100 seconds
+        self.assertLess(elapsed, 20)
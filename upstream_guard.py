@@ -0,0 +1,270 @@
+# rate limit, quota and circuit breaker for calls to the Spoonacular API
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import requests
+from flask import g, has_request_context
+
+try:
+    import fcntl
+except ImportError:  # not on windows; the limiter is then per process
+    fcntl = None
+
+DEGRADED_HEADER = "X-Cookwhat-Degraded"
+
+
+class UpstreamUnavailable(requests.RequestException):
+    """Raised instead of calling the API when the limiter or breaker says no.
+
+    A RequestException, so code already handling network failures
+    handles this too."""
+
+
+# marks made outside a request, e.g. on a gather() worker thread
+_thread = threading.local()
+
+
+def mark_degraded():
+    """Flag the current request as answered from cached or local data.
+
+    Outside a request the flag is kept for the thread, for
+    call_marking_degraded to pick up."""
+    if has_request_context():
+        g.upstream_degraded = True
+    else:
+        _thread.degraded = True
+
+
+def call_marking_degraded(call):
+    """Run call() and return (its result, whether it called mark_degraded).
+
+    For work handed to another thread: the caller passes the flag on with
+    mark_degraded() on its own thread, where the request is."""
+    _thread.degraded = False
+    try:
+        return call(), _thread.degraded
+    finally:
+        _thread.degraded = False
+
+
+def is_degraded():
+    return has_request_context() and g.get("upstream_degraded", False)
+
+
+class RateLimiter:
+    """Token bucket plus daily quota, shared by every worker on the machine.
+
+    - rate: calls per second on average, burst: calls allowed back to back
+    - daily_quota: calls per UTC day (Spoonacular's points reset at UTC
+      midnight); 0 means unlimited
+    - a call without a token waits for one up to max_wait seconds, after
+      that acquire() gives up rather than queue requests behind the API
+
+    With state_path the bucket lives in that file under an flock, so all
+    gunicorn workers draw from the same bucket; without it, it's per process.
+    """
+
+    def __init__(self, rate=5.0, burst=10, daily_quota=0, max_wait=0.5, state_path=None):
+        self.rate = rate
+        self.burst = burst
+        self.daily_quota = daily_quota
+        self.max_wait = max_wait
+        self.state_path = state_path if fcntl else None
+        self._lock = threading.Lock()
+        self._state = {}
+
+    def acquire(self, cost=1):
+        """Take cost tokens; return None, or why the call may not go ahead."""
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            with self._locked_state() as state:
+                if state["exhausted"] or (
+                        self.daily_quota and state["used"] + cost > self.daily_quota):
+                    return "daily API quota used up"
+                if state["tokens"] >= cost:
+                    state["tokens"] -= cost
+                    state["used"] += cost
+                    return None
+                wait = (cost - state["tokens"]) / self.rate
+            if time.monotonic() + wait > deadline:
+                return "API rate limit reached"
+            time.sleep(wait)
+
+    def record_usage(self, used):
+        """Catch up with the API's own count of what we used today."""
+        with self._locked_state() as state:
+            state["used"] = max(state["used"], used)
+
+    def exhaust(self):
+        """The API says the quota is gone; stop calling until tomorrow."""
+        with self._locked_state() as state:
+            state["exhausted"] = True
+
+    def remaining(self):
+        """Calls left today, or None if there's no quota to run out of."""
+        with self._locked_state() as state:
+            if state["exhausted"]:
+                return 0
+            if not self.daily_quota:
+                return None
+            return max(self.daily_quota - state["used"], 0)
+
+    @contextmanager
+    def _locked_state(self):
+        with self._lock:
+            if self.state_path is None:
+                yield self._refill(self._state)
+                return
+            with open(self.state_path, "a+") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    try:
+                        state = json.loads(f.read() or "{}")
+                    except ValueError:
+                        state = {}
+                    yield self._refill(state)
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(state))
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _refill(self, state):
+        now = time.time()
+        today = datetime.utcnow().strftime("%Y-%m-%d")
+        if state.get("day") != today:
+            state["day"] = today
+            state["used"] = 0
+            state["exhausted"] = False
+        tokens = state.get("tokens", self.burst)
+        elapsed = max(now - state.get("updated", now), 0)
+        state["tokens"] = min(self.burst, tokens + elapsed * self.rate)
+        state["updated"] = now
+        return state
+
+
+class CircuitBreaker:
+    """Stop calling the API for a while after it keeps failing.
+
+    After failure_threshold failures in a row the breaker opens and calls
+    fail at once for reset_timeout seconds; then a single trial call goes
+    through, closing it again on success or reopening it on failure.
+    Kept per process, each worker learns about an outage on its own.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if self._trial or time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def allow(self):
+        """Return True if a call may go ahead now."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if not self._trial and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._trial = False
+
+
+class UpstreamGuard:
+    """The limiter and breaker that UpstreamClient checks around every call.
+
+    Configured from API_RATE_LIMIT (calls/second), API_BURST,
+    API_DAILY_QUOTA, API_LIMIT_STATE_DIR (shares the limiter between
+    workers), API_BREAKER_THRESHOLD and API_BREAKER_RESET (seconds).
+    init_app also marks responses built from fallback data with an
+    X-Cookwhat-Degraded: 1 header.
+    """
+
+    def __init__(self, limiter=None, breaker=None):
+        self.limiter = limiter or RateLimiter()
+        self.breaker = breaker or CircuitBreaker()
+
+    def init_app(self, app):
+        config = app.config
+        state_dir = config.get("API_LIMIT_STATE_DIR")
+        self.limiter = RateLimiter(
+            rate=float(config.get("API_RATE_LIMIT") or self.limiter.rate),
+            burst=int(config.get("API_BURST") or self.limiter.burst),
+            daily_quota=int(config.get("API_DAILY_QUOTA") or self.limiter.daily_quota),
+            state_path=os.path.join(state_dir, "spoonacular-limit.json") if state_dir else None,
+        )
+        self.breaker = CircuitBreaker(
+            failure_threshold=int(config.get("API_BREAKER_THRESHOLD")
+                                  or self.breaker.failure_threshold),
+            reset_timeout=float(config.get("API_BREAKER_RESET") or self.breaker.reset_timeout),
+        )
+        app.after_request(self._flag_response)
+
+    def available(self):
+        """Cheap check whether a call would be attempted right now."""
+        return self.breaker.state != "open" and self.limiter.remaining() != 0
+
+    def before_call(self):
+        """Raise UpstreamUnavailable if the call shouldn't go to the API."""
+        # don't spend a token (or wait for one) on a call the breaker refuses
+        if self.breaker.state == "open":
+            raise UpstreamUnavailable("API circuit breaker is open")
+        reason = self.limiter.acquire()
+        if reason is not None:
+            raise UpstreamUnavailable(reason)
+        if not self.breaker.allow():
+            # another request is making the trial call
+            raise UpstreamUnavailable("API circuit breaker is open")
+
+    def after_call(self, response=None):
+        """Record how a call went; response is None if none came back."""
+        if response is None or response.status_code >= 500 or response.status_code == 429:
+            self.breaker.record_failure()
+            return
+        self.breaker.record_success()
+        if response.status_code == 402:
+            # Spoonacular's answer once the daily points are spent
+            self.limiter.exhaust()
+        used = response.headers.get("X-API-Quota-Used")
+        if used:
+            try:
+                self.limiter.record_usage(float(used))
+            except ValueError:
+                pass
+
+    def _flag_response(self, response):
+        if is_degraded():
+            response.headers[DEGRADED_HEADER] = "1"
+        return response
+
+
+upstream_guard = UpstreamGuard()
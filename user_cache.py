@@ -0,0 +1,78 @@
+# per-process cache of logged in users, so before_request doesn't hit the db
+
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy.orm import make_transient_to_detached
+from models import db, User
+
+
+class UserCache:
+    """Column snapshots of recently seen users, keyed by (id, revision).
+
+    get() rebuilds a User from the snapshot and attaches it to the current
+    db session without a query, so routes can use it (and lazy load or
+    update it) like any other loaded row.
+
+    The revision is a value the caller stores in the user's session and
+    changes whenever the user is edited. The session travels with that
+    browser's requests, so whichever worker serves them sees the new
+    revision and drops its old snapshot. Other sessions of the same user
+    (another browser, say) don't carry it: workers keep serving them the
+    old snapshot until it expires, up to ttl seconds after the edit.
+    """
+
+    def __init__(self, ttl=300, maxsize=10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._snapshots = OrderedDict()
+        self._columns = [c.key for c in User.__mapper__.column_attrs]
+
+    def get(self, user_id, revision=None):
+        """Return the user of given id, from cache if we can.
+
+        Return None if there's no such user."""
+        with self._lock:
+            cached = self._snapshots.get(user_id)
+            if cached is not None:
+                snapshot, cached_revision, stored_at = cached
+                if cached_revision == revision and time.monotonic() - stored_at < self.ttl:
+                    self._snapshots.move_to_end(user_id)
+                    return self._attach(snapshot)
+                del self._snapshots[user_id]
+
+        user = User.query.get(user_id)
+        if user is not None:
+            self.set(user, revision)
+        return user
+
+    def set(self, user, revision=None):
+        snapshot = {c: getattr(user, c) for c in self._columns}
+        with self._lock:
+            self._snapshots[user.id] = (snapshot, revision, time.monotonic())
+            self._snapshots.move_to_end(user.id)
+            while len(self._snapshots) > self.maxsize:
+                self._snapshots.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._snapshots.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._snapshots.clear()
+
+    def _attach(self, snapshot):
+        existing = db.session.identity_map.get(
+            db.session.identity_key(User, snapshot["id"]))
+        if existing is not None:
+            return existing
+        user = User(**snapshot)
+        make_transient_to_detached(user)
+        db.session.add(user)
+        return user
+
+
+user_cache = UserCache()